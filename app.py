@@ -14,23 +14,38 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import os, requests, threading
+import os
 import re
 import time
 import tarfile
 import tempfile
-import ocrmypdf
 import shutil
 import subprocess
 import json
 import csv
+import contextvars
+import itertools
+import zlib
+import zipfile
+import uspto_client
+import rate_governor
+import response_cache
+import single_flight
+import ptab_index
+import ptab_documents
+import metrics
+import export_jobs
+import identifiers
+import ocr_pool
+import pdf_cache
+import pdf_jobs
+import ppubs_browser
+import result_cursors
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import StringIO
 from requests.exceptions import RequestException, Timeout, HTTPError
-from dateutil import parser  
-from datetime import datetime          
-from playwright.sync_api import sync_playwright
-from datetime import datetime
-from flask import Flask, render_template, request, Response, stream_with_context, send_file, redirect, url_for
+from flask import Flask, render_template, request, Response, stream_with_context, send_file, redirect, url_for, jsonify, g
+from flask import before_render_template, template_rendered
 from werkzeug.http import parse_options_header
 
 app = Flask(__name__)
@@ -43,8 +58,84 @@ except Exception as e:
 SEARCH_URL  = "https://api.uspto.gov/api/v1/patent/applications/search"
 
 
-PDF_CACHE_DIR = "uspto_pdf_cache"
-os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+PDF_CACHE_DIR = pdf_cache.CACHE_DIR
+
+# How cached PDFs leave the app:
+#   ""         - Flask streams them (with ETag / 304 / Range support)
+#   "nginx"    - X-Accel-Redirect to PDF_ACCEL_PREFIX + file name; nginx needs an
+#                `internal` location there aliased to the uspto_pdf_cache directory
+#   "sendfile" - X-Sendfile with the file's path (Apache mod_xsendfile, lighttpd)
+PDF_ACCEL = os.environ.get("PDF_ACCEL", "")
+PDF_ACCEL_PREFIX = os.environ.get("PDF_ACCEL_PREFIX", "/protected_pdfs/")
+app.config["USE_X_SENDFILE"] = PDF_ACCEL == "sendfile"
+
+# Browser cache lifetime per kind of cached PDF. OCR'd files and PTAB documents never
+# change once written; a raw copy is only meant to be looked at once before OCR
+PDF_MAX_AGE = {
+    "ocr": 365 * 24 * 3600,
+    "ptab_doc": 365 * 24 * 3600,
+    "raw": 24 * 3600,
+}
+PDF_IMMUTABLE_KINDS = {"ocr", "ptab_doc"}
+
+# Bytes per chunk when streaming a PTAB document through to the browser
+PTAB_DOC_CHUNK = 64 * 1024
+
+# How often the local PTAB proceedings index syncs with developer.uspto.gov (0 = never;
+# sync it from cron with `python ptab_index.py sync` instead)
+PTAB_INDEX_SYNC_INTERVAL = 6 * 3600
+
+# ?refresh=1 on any page skips the response cache and refetches from USPTO/PTAB.
+# Each request also gets its own memo, so a lookup repeated within one page render runs once
+@app.before_request
+def set_request_scope():
+    response_cache.bypass.set(request.values.get("refresh") == "1")
+    single_flight.start_request()
+    metrics.start_request()
+    g.request_started = time.perf_counter()
+
+# Server-Timing stages that are calls to an upstream API (see uspto_client.call_type)
+UPSTREAM_STAGES = ("uspto", "ptab", "ppubs", "upstream")
+
+REQUEST_SECONDS = metrics.Histogram(
+    "http_request_seconds", "Time to produce a response (streamed bodies not included)", ["endpoint", "status"]
+)
+REQUEST_UPSTREAM_CALLS = metrics.Histogram(
+    "http_request_upstream_calls", "Upstream API calls made while producing one response", ["endpoint"],
+    buckets=metrics.COUNT_BUCKETS,
+)
+RENDER_SECONDS = metrics.Histogram("template_render_seconds", "Jinja render time", ["template"])
+
+# Every response says where its time went, e.g. Server-Timing: uspto;dur=812.4, family;dur=640.2, render;dur=35.0
+@app.after_request
+def add_server_timing(response):
+    started = g.get("request_started")
+    if started is None:
+        return response
+    total = time.perf_counter() - started
+    endpoint = request.endpoint or "unknown"
+    response.headers["Server-Timing"] = metrics.server_timing(total)
+    REQUEST_SECONDS.observe(total, endpoint=endpoint, status=response.status_code)
+    REQUEST_UPSTREAM_CALLS.observe(sum(metrics.calls(stage) for stage in UPSTREAM_STAGES), endpoint=endpoint)
+    return response
+
+def start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+def stop_render_timer(sender, template, context, **extra):
+    started = g.pop("render_started", None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        metrics.add_timing("render", elapsed)
+        RENDER_SECONDS.observe(elapsed, template=template.name)
+
+before_render_template.connect(start_render_timer, app)
+template_rendered.connect(stop_render_timer, app)
+
+# Wraps fn so worker threads see the calling request's context vars (cache bypass, memo)
+def with_current_context(fn):
+    ctx = contextvars.copy_context()
+    return lambda *args: ctx.copy().run(fn, *args)
 
 #MAIN logic to populate index.html
 @app.route("/", methods=["GET", "POST"])
@@ -70,8 +161,8 @@ def home():
     proceeding_number = request.args.get("proceeding_number", None)
     proceeding_number = proceeding_number.strip() if proceeding_number else ""
 
-    #This gets set from the confirm_large_results.html page
-    confirm_large = request.form.get("confirm_large", "").lower() == "true"
+    #This gets set from the confirm_large_results.html page (or the URL of a results page)
+    confirm_large = request.values.get("confirm_large", "").lower() == "true"
     
     
     # Results - search results from query to PTO search API
@@ -98,6 +189,7 @@ def home():
     ptab_po = ""
     ptab_application_number = ""
     id_to_try = ""
+    search_term_is_identifier = False
 
 
     # If patent_info remains None, the "Patent Details" section won’t render.
@@ -105,15 +197,30 @@ def home():
     # If documents or proceedings aren't populated, their tables are skipped.
 
    
+    # A search box entry that names one patent, application, publication or docket goes
+    # down the same exact lookup as the matching URL argument; only free text is searched
+    if search_term and not (application_number or patent_number or publication_number or proceeding_number):
+        kind, value = classify_identifier(search_term)
+        if kind == "docket":
+            proceeding_number = value
+        elif kind == "patent":
+            patent_number = value
+        elif kind == "application":
+            application_number = value
+        elif kind == "publication":
+            publication_number = value
+        if kind:
+            print(f"🔎 Search box entry {search_term!r} looked up as {kind} {value}")
+            search_term_is_identifier = True
+
     try:
-        # ─── 1: IF [letters]YYYY-xxxx, or a PTAB docket # was clicked, get PTAB DOCUMENTS and return───        
-        if re.match(r"^[A-Za-z]+\d{4}-\d+$", search_term) or proceeding_number:
-            proceeding_number = proceeding_number or search_term
+        # ─── 1: IF a PTAB docket # was entered or clicked, get PTAB DOCUMENTS and return───        
+        if proceeding_number:
             template_name, t_args = ptab_structured_search(proceeding_number)            
             return render_template(template_name, **t_args)
             
-        # ─── 2: IF search box and not PTAB Docket  #, do unstructured search box processing───
-        elif search_term:
+        # ─── 2: IF search box and not an identifier, do unstructured search box processing───
+        elif search_term and not search_term_is_identifier:
             template_name, t_args = unstructured_search(search_term, confirm_large)
             return render_template(template_name, **t_args)                
         
@@ -140,12 +247,16 @@ def home():
         
             if q:
                 #print(f"q block entered with {q}")
-                pfws = []
+                pfw = None
                 try:
                     #print(f"Trying to fetch pages using {q}")
                     try:
-                        total, pfws = fetch_all_pages(q)
+                        total, pfw = fetch_application_detail(q)
                         #print(f"Fetched with total: {total}")
+                        # 8 digits starting 10-12 can be a patent # or an application #
+                        if not total and patent_number and identifiers.AMBIGUOUS_PATENT_NUMBER.fullmatch(patent_number):
+                            q = f"applicationNumberText:{patent_number}"
+                            total, pfw = fetch_application_detail(q)
                     except ValueError as e:
                         print(f"⚠️ USPTO fetch failed with error: {e}, trying PTAB fallback")
                         error = f"USPTO lookup failed: {e}"
@@ -155,43 +266,19 @@ def home():
                             print(f"❌ PTAB fallback also failed: {ptab_e}")
                             error = f"USPTO and PTAB lookup both failed: {ptab_e}"
 
-                    if total > 0:
+                    if total > 0 and pfw:
                         try:
-                            #print(f"Trying to extract from {pfws[0]}")
-                            patent_info, events, proceedings = extract_patent_details(pfws[0])
+                            #print(f"Trying to extract from {pfw}")
+                            patent_info, events, proceedings = extract_patent_details(pfw)
                             #print(f"Returned from extract")
 
                             # 🧬 Recursively build family tree
                             #print("Calling gather_family_tree now:")
-                            family_tree = gather_family_tree(patent_info.get("application_number"))
-
-
-                            family_members = []
-                            for app_no in family_tree:
-                                if app_no == patent_info.get("application_number"):
-                                    continue  # Skip self
-
-                                try:
-                                    print(f"Fetching pages for {app_no}")
-                                    total, pfws = fetch_all_pages(f"applicationNumberText:{app_no}", limit=1)
-
-                                    # Defensive checks
-                                    if pfws and isinstance(pfws, list) and isinstance(pfws[0], dict):
-                                        pfw = pfws[0]
-                                        patent_info_entry, _, _ = extract_patent_details(pfw)
-                                        family_members.append({
-                                            "application_number": app_no,
-                                            "patent_number": patent_info_entry.get("patent_number", ""),
-                                            "title": patent_info_entry.get("title", "(No Title)"),
-                                            "filing_date": patent_info_entry.get("filing_date", "—"),
-                                        })
-                                    else:
-                                        print(f"⚠️ No valid PFW data returned for {app_no}: pfws={pfws}")
-                                except Exception as e:
-                                    print(f"⚠️ Could not extract details for {app_no}: {e}")
-
-                          
-                  
+                            with metrics.timed("family", FAMILY_SECONDS):
+                                family_tree = gather_family_tree(patent_info.get("application_number"))
+
+
+                                family_members = build_family_members(family_tree, patent_info.get("application_number"))
 
                         except Exception as e:
                             print(f"Failed to extract details from USPTO hit: {e}")
@@ -255,8 +342,8 @@ def home():
         total_results=total,
     )
 
-# Runs the search logic for the search box.  Called only if the search_term wasn't in
-# a PTAB docket number form like IPR2014-00342
+# Runs the search logic for the search box.  Called only if the search_term wasn't an
+# identifier classify_identifier recognizes (patent #, app #, pub #, PTAB docket #, ...)
 # returns template info and template arguments to home to render
 def unstructured_search(search_term, confirm_large):
     # ───  SEARCH BOX FLOW IF WE DON'T KNOW WHAT THE USER IS SEARCHING FOR ───
@@ -280,22 +367,19 @@ def unstructured_search(search_term, confirm_large):
 
 
     try:
-        fields = [
-            "assignmentBag.assigneeBag.assigneeNameText",
-            "applicationNumberText",
-            "applicationMetaData.filingDate",
-            "applicationMetaData.pctPublicationNumber",                        
-            "applicationMetaData.applicationStatusDescriptionText",
-            "applicationMetaData.inventionTitle",
-            "applicationMetaData.patentNumber"
-        ]
         # Determine result cap based on whether user has confirmed they want all results
         limit = None if confirm_large else 1000
 
+        # Same search still held server-side (e.g. user navigated back): reuse it
+        cursor_id = result_cursors.cursor_id_for(search_term, limit)
+        cursor = None if response_cache.bypass.get() else result_cursors.get(cursor_id)
+        if cursor:
+            return "index.html", results_page_args(cursor_id, cursor, confirm_large)
+
         # Fetch results: either capped at 1000 or full set if confirmed
         total, pfws = fetch_all_pages(
             search_term,
-            fields=fields,
+            fields=FIELD_PROFILES["results-row"],
             limit=limit
         )
 
@@ -326,38 +410,19 @@ def unstructured_search(search_term, confirm_large):
 
             # Only one hit, so try to display it as a details page
             if total == 1:
+                # The hit only has results-row fields; the details page needs the full wrapper
                 pfw = pfws[0]
+                app_no = pfw.get("applicationNumberText") or ""
+                if re.fullmatch(r"\d+", app_no):
+                    pfw = fetch_application_detail(f"applicationNumberText:{app_no}")[1] or pfw
                 patent_info, events, _ = extract_patent_details(pfw)
                 print("running family tree")
-                family_tree = gather_family_tree(patent_info.get("application_number"))
-                print("returned from family tree call")
-                
-                family_members = []
-                for app_no in family_tree:
-                    if app_no == patent_info.get("application_number"):
-                        continue  # Skip self
-
-                    try:
-                        print(f"Fetching pages for {app_no}")
-                        total, pfws = fetch_all_pages(f"applicationNumberText:{app_no}", limit=1)
-
-                        # Defensive checks
-                        if pfws and isinstance(pfws, list) and isinstance(pfws[0], dict):
-                            pfw = pfws[0]
-                            patent_info_entry, _, _ = extract_patent_details(pfw)
-                            family_members.append({
-                                "application_number": app_no,
-                                "patent_number": patent_info_entry.get("patent_number", ""),
-                                "title": patent_info_entry.get("title", "(No Title)"),
-                                "filing_date": patent_info_entry.get("filing_date", "—"),
-                            })
-                        else:
-                            print(f"⚠️ No valid PFW data returned for {app_no}: pfws={pfws}")
-                    except Exception as e:
-                        print(f"⚠️ Could not extract details for {app_no}: {e}")
+                with metrics.timed("family", FAMILY_SECONDS):
+                    family_tree = gather_family_tree(patent_info.get("application_number"))
+                    print("returned from family tree call")
 
+                    family_members = build_family_members(family_tree, patent_info.get("application_number"))
 
-  
             # If extract failed or patent_info is missing key info, fill from PTAB if available
             if not patent_info:
                 patent_info = {}
@@ -425,13 +490,12 @@ def unstructured_search(search_term, confirm_large):
 
 
         fallback_hits = set(p.get("number") for p in proceedings if "number" in p)
-        for field in ["patentOwnerName", "partyName"]:
-            extra_hits = search_ptab_by_id(search_term, all=True)
-            for proc in extra_hits:
-                proc_num = proc.get("number")
-                if proc_num and proc_num not in fallback_hits:
-                    fallback_hits.add(proc_num)
-                    proceedings.append(proc)
+        extra_hits = search_ptab_by_id(search_term, all=True)
+        for proc in extra_hits:
+            proc_num = proc.get("number")
+            if proc_num and proc_num not in fallback_hits:
+                fallback_hits.add(proc_num)
+                proceedings.append(proc)
 
     except RateLimitExceeded:
         error = "USPTO API rate limit reached. Please try again later."
@@ -440,6 +504,11 @@ def unstructured_search(search_term, confirm_large):
     if family_members:
         family_members = sort_family_members(family_members)
 
+    # Keep the results table server-side; the page shows one page of it at a time
+    if results and not error:
+        result_cursors.put(cursor_id, search_term, results, total, proceedings=proceedings)
+        return "index.html", results_page_args(cursor_id, result_cursors.get(cursor_id), confirm_large)
+
     return "index.html", {
         "search_term": search_term,
         "application_number": "",
@@ -456,21 +525,39 @@ def unstructured_search(search_term, confirm_large):
         "total_results": total if search_term and total > 1 else None,
     }
 
+# Template args for a results table held in result_cursors: the first page of rows is
+# rendered, the rest is paged/sorted/filtered through /results/<cursor_id>
+def results_page_args(cursor_id, cursor, confirm_large=False):
+    rows, matched = result_cursors.page(cursor, per_page=RESULTS_PER_PAGE)
+    return {
+        "search_term": cursor.search_term,
+        "application_number": "",
+        "patent_number": "",
+        "publication_number": "",
+        "proceeding_number": "",
+        "documents": [],
+        "patent": None,
+        "family_members": [],
+        "events": [],
+        "proceedings": cursor.extras.get("proceedings", []),
+        "results": rows,
+        "results_count": matched,
+        "results_per_page": RESULTS_PER_PAGE,
+        "results_statuses": result_cursors.distinct(cursor, "status"),
+        "cursor_id": cursor_id,
+        "confirm_large": confirm_large,
+        "error": None,
+        "total_results": cursor.total if cursor.total > 1 else None,
+    }
+
 # Takes a PTAB docket # and returns any documents found for that matter
 # as well as the proceedings info that search_ptab_by_id returns to get biblio info if needed
 def ptab_structured_search(proceeding_number):
     try:
-        documents = get_ptab_documents(proceeding_number)
+        documents = get_ptab_documents(proceeding_number)  # Newest first, then lowest doc number
 
         proceedings = search_ptab_by_id(proceeding_number)
 
-        documents.sort(
-            key=lambda d: (
-                -parse_date(d.get("filing_date", "")).timestamp(),  # Newest date first
-                parse_doc_number(d.get("document_number", ""))      # Lowest doc number first
-            )
-        )
-
         return "index.html", {
             "search_term": proceeding_number,
             "application_number": "",
@@ -589,56 +676,102 @@ def extract_patent_details(pfw):
 
     return patent_info, events, proceedings
 
-# Incrementally request all search hits based on passed query q
-# Returns the hits in pfws and total = count of the hits, 0 if none
-def fetch_all_pages(q, fields=None, limit=1000):
-    #Max page_size in current USPTO API is 100
-    page_size = 100
-    offset = 0
-    all_pfws = []
+# Named field projections for search calls, one per view, so each page only
+# downloads the parts of the file wrapper it actually shows. None = no projection
+# (the whole wrapper, event history and all)
+FIELD_PROFILES = {
+    # One row of the search results table
+    "results-row": [
+        "assignmentBag.assigneeBag.assigneeNameText",
+        "applicationNumberText",
+        "applicationMetaData.filingDate",
+        "applicationMetaData.pctPublicationNumber",
+        "applicationMetaData.applicationStatusDescriptionText",
+        "applicationMetaData.inventionTitle",
+        "applicationMetaData.patentNumber",
+    ],
+    # One row of the family members table
+    "family-row": [
+        "applicationNumberText",
+        "applicationMetaData.inventionTitle",
+        "applicationMetaData.patentNumber",
+        "applicationMetaData.pctPublicationNumber",
+        "applicationMetaData.filingDate",
+        "applicationMetaData.effectiveFilingDate",
+    ],
+    # The application shown on the details page
+    "full-detail": None,
+}
+
+# Looks up the one application q identifies for the details page. Returns
+# (total hits for q, full file wrapper of the first hit or None).
+# The full wrapper is fetched once on q itself; when q was a patent/publication
+# query, the same page is also cached under the hit's application #, so the
+# details page and later applicationNumberText lookups don't download it again
+def fetch_application_detail(q):
+    fields = FIELD_PROFILES["full-detail"]
+    total, pfws = fetch_all_pages(q, fields=fields, limit=1)
+    if not pfws:
+        return 0, None
+    app_no = pfws[0].get("applicationNumberText") or ""
+    # PCT application #s can't be queried by applicationNumberText
+    if not q.startswith("applicationNumberText:") and re.fullmatch(r"\d+", app_no):
+        cache_search_page(
+            f"applicationNumberText:{app_no}", 0, 1, fields,
+            {"count": 1, "patentFileWrapperDataBag": pfws[:1]},
+        )
+    return total, pfws[0]
+
+# Query prefixes that look up one exact application, patent or publication
+EXACT_QUERY_FIELDS = (
+    "applicationNumberText:",
+    "applicationMetaData.patentNumber:",
+    "applicationMetaData.earliestPublicationNumber:",
+    "applicationMetaData.pctPublicationNumber:",
+    "publicationNumberText:",
+)
+
+# Exact-id pages whose hits are all granted barely change, so they're cached longer
+def search_page_ttl(q, data):
+    pfws = data.get("patentFileWrapperDataBag", [])
+    if q.startswith(EXACT_QUERY_FIELDS) and pfws and all(
+        pfw.get("applicationMetaData", {}).get("patentNumber") for pfw in pfws
+    ):
+        return response_cache.TTLS["biblio"]
+    return response_cache.TTLS["search"]
+
+# Stores data as the cached page fetch_search_page would return for these arguments
+def cache_search_page(q, offset, page_size, fields, data):
+    key = response_cache.make_key("search", SEARCH_URL, q, fields, offset=offset, limit=page_size)
+    response_cache.put(key, "search", data, search_page_ttl(q, data))
+
+# Requests one page of search hits (cached); returns the response JSON, or None on 404
+def fetch_search_page(q, offset, page_size, fields=None):
     headers = {
         "accept": "application/json",
         "X-API-KEY": API_KEY,
         "Content-Type": "application/json",
     }
-    max_retries = 4
+    payload = {
+        "q": q,
+        "pagination": {"offset": offset, "limit": page_size}
+    }
+    if fields:
+        payload["fields"] = fields
 
-    while True:
-        # Adjust page_size to not exceed remaining needed if limit is set
-        actual_limit = limit - len(all_pfws) if limit is not None else page_size
-        current_page_size = min(actual_limit, page_size)
+    def fetch():
+        try:
+            resp = uspto_client.post(SEARCH_URL, json=payload, headers=headers)
+            #print(f"✅ Got response: status={resp.status_code}")
 
-        payload = {
-            "q": q,
-            "pagination": {"offset": offset, "limit": current_page_size}
-        }
-        if fields:
-            payload["fields"] = fields
-
-        delay = 1
-        for attempt in range(max_retries):
-            try:
-                resp = requests.post(SEARCH_URL, json=payload, headers=headers, timeout=(5, 30))
-                #print(f"✅ Got response: status={resp.status_code}")
-
-                if resp.status_code == 429:
-                    print(f"⚠️ Rate limited, sleeping {delay}s")
-                    time.sleep(delay)
-                    delay *= 2
-                    continue
-
-                if resp.status_code == 404:
-                    print(f"❌ 404 Not Found for query: {q}")
-                    return 0, []
-
-                resp.raise_for_status()
-                break
-            except Exception as e:
-                print(f"❌ Attempt {attempt+1} failed: {e}")
-                if attempt == max_retries - 1:
-                    raise RateLimitExceeded(f"Rate limit exceeded or error on attempt {attempt + 1}: {e}")
-                time.sleep(delay)
-                delay *= 2
+            if resp.status_code == 404:
+                print(f"❌ 404 Not Found for query: {q}")
+                return None
+
+            resp.raise_for_status()
+        except Exception as e:
+            print(f"❌ Search request failed: {e}")
+            raise RateLimitExceeded(f"Rate limit exceeded or error: {e}")
 
         try:
             data = resp.json()
@@ -648,144 +781,311 @@ def fetch_all_pages(q, fields=None, limit=1000):
 
         if "patentFileWrapperDataBag" not in data:
             raise ValueError(f"Missing key 'patentFileWrapperDataBag'. Response: {data}")
+        return data
 
-        pfws = data.get("patentFileWrapperDataBag", [])
-        all_pfws.extend(pfws)
-        total = data.get("count", 0)
+    key = response_cache.make_key("search", SEARCH_URL, q, fields, offset=offset, limit=page_size)
+    return response_cache.get_or_fetch(
+        "search", key, fetch,
+        is_empty=lambda data: not data or not data.get("patentFileWrapperDataBag"),
+        ttl=lambda data: search_page_ttl(q, data),
+    )
 
-        offset += current_page_size
+# Max search pages in flight at once when fetch_all_pages runs concurrently
+PAGE_FETCH_WORKERS = 4
 
-        if len(all_pfws) >= total:
-            print(f"✅ Reached end of available results: {len(all_pfws)} of {total}")
-            break
+# Extra tries for one failed page before the whole fetch gives up
+PAGE_RETRIES = 2
 
-        if limit is not None and len(all_pfws) >= limit:
-            print(f"✅ Reached user-defined limit: {limit} (available: {total})")
-            break
+# fetch_search_page, but a page that still fails after the client's own retries is
+# retried by itself a couple more times instead of failing the whole fetch
+def fetch_page_with_retry(q, offset, page_size, fields=None):
+    for attempt in range(PAGE_RETRIES + 1):
+        try:
+            return fetch_search_page(q, offset, page_size, fields)
+        except RateLimitExceeded as e:
+            if attempt == PAGE_RETRIES:
+                raise
+            print(f"⚠️ Page at offset {offset} failed ({e}), retrying just that page")
+            time.sleep(2 ** attempt)
+
+# Yields the search response for each page of hits for q, in offset order, up to
+# limit hits (None = all). The first page tells us the total; after that up to
+# `concurrency` pages are kept in flight ahead of the consumer (1 = one at a time),
+# so memory stays flat however many hits there are.
+# Yields None and stops if a page comes back 404
+def iter_search_pages(q, fields=None, limit=None, concurrency=PAGE_FETCH_WORKERS):
+    #Max page_size in current USPTO API is 100
+    page_size = 100
+    first_size = page_size if limit is None else min(limit, page_size)
+
+    data = fetch_page_with_retry(q, 0, first_size, fields)
+    yield data
+    if data is None:
+        return
+
+    total = data.get("count", 0)
+    wanted = total if limit is None else min(total, limit)
+    windows = iter([
+        (offset, min(page_size, wanted - offset))
+        for offset in range(first_size, wanted, page_size)
+    ])
+
+    if concurrency <= 1:
+        for offset, size in windows:
+            data = fetch_page_with_retry(q, offset, size, fields)
+            yield data
+            if data is None:
+                return
+        return
+
+    fetch = with_current_context(lambda window: fetch_page_with_retry(q, window[0], window[1], fields))
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        in_flight = [pool.submit(fetch, w) for w in itertools.islice(windows, concurrency)]
+        while in_flight:
+            data = in_flight.pop(0).result()
+            for w in itertools.islice(windows, 1):
+                in_flight.append(pool.submit(fetch, w))
+            yield data
+            if data is None:
+                return
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+# Request all search hits based on passed query q, up to limit (None = all)
+# Returns the hits in pfws and total = count of the hits, 0 if none
+def fetch_all_pages(q, fields=None, limit=1000, concurrency=PAGE_FETCH_WORKERS):
+    total = 0
+    all_pfws = []
+
+    for page, data in enumerate(iter_search_pages(q, fields, limit, concurrency)):
+        if data is None:
+            return 0, []
+        if page == 0:
+            total = data.get("count", 0)
+        all_pfws.extend(data.get("patentFileWrapperDataBag", []))
+
+    if limit is not None and total > limit:
+        print(f"✅ Reached user-defined limit: {limit} (available: {total})")
+    else:
+        print(f"✅ Reached end of available results: {len(all_pfws)} of {total}")
 
     return  (total, all_pfws)
 
 #Retreives list of PTAB documents for a given proceeding and populates them in returned docs
 def get_ptab_documents(proceeding_number):
     """
-    #TODO: handle records in excess of 500
-    Retrieve documents for a given PTAB proceeding number.
+    Retrieve documents for a given PTAB proceeding number, newest filing first.
+    The full list is kept in ptab_documents and only new filings are fetched on refresh;
+    ?refresh=1 checks for new filings right away.
     """
-    url = f"https://developer.uspto.gov/ptab-api/documents?proceedingNumber={proceeding_number}&recordTotalQuantity=500"
     try:
-        resp = requests.get(url, headers={"accept": "application/json"}, timeout=(5, 30))
-        resp.raise_for_status()
-        docs = []
-        for item in resp.json().get("results", []):
-            docs.append({
-                "filing_date": item.get("documentFilingDate", "—"),
-                "document_type": item.get("documentTypeName", "—"),
-                "document_number": item.get("documentNumber", "—"),
-                "document_identifier": item.get("documentIdentifier"),
-                "document_name": item.get("documentName", "—"),
-            })
-        return docs
+        return ptab_documents.get(proceeding_number, force_refresh=response_cache.bypass.get())
     except Exception as e:
         print(f"Error fetching PTAB documents: {e}")
         return []
 
+PTAB_PROCEEDINGS_URL = "https://developer.uspto.gov/ptab-api/proceedings"
+
+# Raw PTAB proceedings results where field == value (cached)
+def fetch_ptab_proceedings(field, value):
+    def fetch():
+        resp = uspto_client.get(
+            PTAB_PROCEEDINGS_URL,
+            params={field: value, "recordTotalQuantity": 1000},
+            headers={"accept": "application/json"},
+        )
+        resp.raise_for_status()
+        return resp.json().get("results", [])
+
+    key = response_cache.make_key("ptab_proceedings", "proceedings", value, field=field)
+    return response_cache.get_or_fetch("ptab_proceedings", key, fetch, is_empty=lambda results: not results)
+
+# Search box kinds for the identifiers.normalize() kinds that home() doesn't take as they are.
+# Bare 8-digit 10-12 series numbers are tried as patents first (home() then retries them as
+# applications); bare 5-6 digits are searched as free text
+SEARCH_BOX_KINDS = {
+    "pct": "application",
+    "wo": "publication",
+    "patent_or_application": "patent",
+    "number": None,
+}
+
+# Works out whether search box input is one exact identifier (see identifiers.normalize),
+# normalized to what the structured lookups in home() expect. Returns (kind, value) with
+# kind one of "docket", "patent", "application" or "publication", or (None, search_term)
+# for free text
+def classify_identifier(search_term):
+    kind, value = identifiers.normalize(search_term)
+    kind = SEARCH_BOX_KINDS.get(kind, kind)
+    if not kind:
+        return None, str(search_term or "").strip()
+    return kind, value
+
+# PTAB proceedings fields that can possibly match each kind of identifier, in the
+# order search_ptab_by_id prefers their hits
+PTAB_FIELDS_BY_KIND = {
+    "docket": ["proceedingNumber"],
+    "patent": ["patentNumber"],
+    "application": ["applicationNumberText"],
+    "patent_or_application": ["patentNumber", "applicationNumberText"],
+    "pct": [],
+    "publication": [],
+    "party": ["patentOwnerName", "partyName"],
+}
+
+# PTAB kinds for the identifiers.normalize() kinds that PTAB_FIELDS_BY_KIND doesn't have;
+# bare 5-6 digits can only be an old patent # there
+PTAB_KINDS = {
+    "wo": "pct",
+    "number": "patent",
+}
+
+# Works out what kind of identifier a PTAB lookup value is (see identifiers.normalize);
+# anything that isn't one is taken as a party name
+# Returns (kind, value normalized the way the PTAB API stores it)
+def classify_ptab_identifier(value):
+    kind, normalized = identifiers.normalize(value)
+    if not kind:
+        return "party", str(value or "").strip()
+    return PTAB_KINDS.get(kind, kind), normalized
+
 # Finds if any PTAB proceedings are associated with the passed reference (pat#, app#,docket#, party name)
+# Each field is answered from the local ptab_index first; the live API is only asked on an
+# index miss, and not even then if the index synced recently enough to trust the miss.
+# Only the fields that can match that kind of reference are queried, concurrently when there
+# are several; hits are taken from the first field (in PTAB_FIELDS_BY_KIND order) that has any,
+# or merged across all of them when all=True
 # Returns proceedings, including patent #, application # and PO name
-def search_ptab_by_id(id, all=False):    
-    url_fields = [
-        "patentNumber",
-        "applicationNumberText",
-        "proceedingNumber",
-        "patentOwnerName",
-        "partyName"
-    ]
+def search_ptab_by_id(id, all=False):
+    kind, value = classify_ptab_identifier(id)
+    url_fields = PTAB_FIELDS_BY_KIND[kind]
     proceedings = []
     seen_numbers = set()  # Prevent duplicates if same proceeding appears in multiple fields
 
-    for field in url_fields:
+    def lookup(field):
         try:
-            url = f"https://developer.uspto.gov/ptab-api/proceedings?{field}={id}&recordTotalQuantity=1000"
-            resp = requests.get(url, headers={"accept": "application/json"}, timeout=(5, 30))
-            resp.raise_for_status()
-            results = resp.json().get("results", [])
-
-            for r in results:
-                proc_num = r.get("proceedingNumber")
-                if proc_num and proc_num not in seen_numbers:
-                    seen_numbers.add(proc_num)
-                    proceedings.append({
-                        "number": proc_num,
-                        "status": r.get("proceedingStatusCategory"),
-                        "petitioner": r.get("petitionerPartyName"),
-                        "filing_date": r.get("proceedingFilingDate"),
-                        "ptab_patent_number": r.get("respondentPatentNumber"),
-                        "ptab_application_number": r.get("respondentApplicationNumberText"),
-                        "ptab_patent_owner": r.get("respondentPartyName"),
-                    })
-
-            if proceedings and not all:
-                break  # Exit early if we've found matches and not running in "all" mode
-
+            indexed = ptab_index.lookup(field, value)
+            if indexed or (indexed is not None and ptab_index.is_fresh()):
+                return indexed
+        except Exception as e:
+            print(f"⚠️ PTAB index lookup failed for field={field}; id={id}: {e}")
+        try:
+            return fetch_ptab_proceedings(field, value)
         except Exception as e:
             print(f"PTAB fetch error using field={field}; id={id}: {e}")
-            continue
+            return []
+
+    if len(url_fields) > 1:
+        with ThreadPoolExecutor(max_workers=len(url_fields)) as pool:
+            results_by_field = list(pool.map(with_current_context(lookup), url_fields))
+    else:
+        results_by_field = [lookup(field) for field in url_fields]
+
+    for results in results_by_field:
+        for r in results:
+            proc_num = r.get("proceedingNumber")
+            if proc_num and proc_num not in seen_numbers:
+                seen_numbers.add(proc_num)
+                proceedings.append({
+                    "number": proc_num,
+                    "status": r.get("proceedingStatusCategory"),
+                    "petitioner": r.get("petitionerPartyName"),
+                    "filing_date": r.get("proceedingFilingDate"),
+                    "ptab_patent_number": r.get("respondentPatentNumber"),
+                    "ptab_application_number": r.get("respondentApplicationNumberText"),
+                    "ptab_patent_owner": r.get("respondentPartyName"),
+                })
+
+        if proceedings and not all:
+            break  # Exit early if we've found matches and not running in "all" mode
 
     return proceedings
 
+# Serves a file from the PDF cache with a strong ETag (its checksum), Last-Modified,
+# conditional GET / Range handling and Cache-Control, or hands it to the front proxy
+# (see PDF_ACCEL). Entries saved with a filename are sent inline under that name.
+# Returns None if the file isn't cached
+def send_cached_pdf(name):
+    file_path = pdf_cache.lookup(name)
+    entry = pdf_cache.get(name) if file_path else None
+    if not entry:
+        return None
+
+    mimetype = entry["content_type"] or "application/pdf"
+    if PDF_ACCEL == "nginx":
+        resp = Response(mimetype=mimetype)
+        resp.headers["X-Accel-Redirect"] = PDF_ACCEL_PREFIX + name
+        resp.set_etag(entry["sha256"])
+        resp.last_modified = entry["created"]
+    else:
+        resp = send_file(
+            file_path,
+            mimetype=mimetype,
+            conditional=True,
+            etag=entry["sha256"],
+            last_modified=entry["created"],
+        )
+    max_age = PDF_MAX_AGE.get(entry["kind"], 0)
+    resp.headers["Cache-Control"] = f"public, max-age={max_age}" + (
+        ", immutable" if entry["kind"] in PDF_IMMUTABLE_KINDS else ""
+    )
+    resp.headers["Accept-Ranges"] = "bytes"
+    if entry["filename"]:
+        resp.headers["Content-Disposition"] = f'inline; filename="{entry["filename"]}"'
+    return resp
+
 #Logic to handle download and OCR of patent using headless browswer since
 #no PDF API that doesn't require huge TAR download
 #=================================
 @app.route("/uspto_pdf/<patent_number>")
 def uspto_pdf(patent_number):
-    cached_path = os.path.join(PDF_CACHE_DIR, f"{patent_number}.pdf")
-    raw_path = os.path.join(PDF_CACHE_DIR, f"{patent_number}_raw.pdf")
-    log_path = os.path.join(PDF_CACHE_DIR, f"{patent_number}.log")
-
-    if os.path.exists(cached_path):
-        return send_file(cached_path, mimetype="application/pdf")
+    cached = send_cached_pdf(pdf_cache.ocr_name(patent_number))
+    if cached:
+        return cached
 
-    if os.path.exists(raw_path):
+    if pdf_cache.lookup(pdf_cache.raw_name(patent_number), touch=False):
         return render_template("choose_pdf.html", patent_number=patent_number)
 
-    thread = threading.Thread(target=download_raw_pdf, args=(patent_number,), daemon=True)
-    thread.start()
+    try:
+        pdf_jobs.enqueue(patent_number, "download")
+    except pdf_jobs.QueueFull as e:
+        return str(e), 503
     return redirect(url_for("ocr_progress", patent_number=patent_number))
 
-#Gets the PDF from ppubs if requested
+#Gets the PDF from ppubs; runs as a pdf_jobs "download" job and raises on failure
 def download_raw_pdf(patent_number):
-    raw_path = os.path.join(PDF_CACHE_DIR, f"{patent_number}_raw.pdf")
     log_path = os.path.join(PDF_CACHE_DIR, f"{patent_number}.log")
 
     try:
         with open(log_path, "a") as log:
             log.write("🔍 Starting raw PDF lookup...\n")
 
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
-            page.goto("https://ppubs.uspto.gov/pubwebapp/static/pages/ppubsbasic.html")
-            page.fill("#quickLookupTextInput", str(patent_number))
-            page.keyboard.press("Enter")
-            page.wait_for_selector("a[href*='downloadPdf']", timeout=10000)
-            hrefs = page.locator("a[href*='downloadPdf']").evaluate_all("els => els.map(e => e.href)")
-            browser.close()
-
-            pdf_url = next((url for url in hrefs if str(patent_number) in url), None)
-            if not pdf_url:
-                raise Exception(f"No PDF URL found for {patent_number}")
-
-            print(f"Getting pdf: {pdf_url}")
-            resp = requests.get(pdf_url)
-            resp.raise_for_status()
-            with open(raw_path, "wb") as f:
-                f.write(resp.content)
+        pdf_jobs.set_progress(patent_number, "download", 10, "Looking up the PDF on ppubs")
+        pdf_url, source = ppubs_browser.resolve_pdf_url(patent_number)
+
+        pdf_jobs.set_progress(patent_number, "download", 40, "Downloading the PDF")
+        print(f"Getting pdf ({source}): {pdf_url}")
+        resp = uspto_client.get(pdf_url)
+        if source != "browser" and (resp.status_code != 200 or not resp.content.startswith(b"%PDF")):
+            # Remembered or predicted URL didn't work; ask ppubs for the real one
+            print(f"⚠️ {source} PDF URL for {patent_number} failed, looking it up on ppubs")
+            ppubs_browser.forget(patent_number)
+            pdf_url, source = ppubs_browser.resolve_pdf_url(patent_number, use_cache=False)
+            resp = uspto_client.get(pdf_url)
+        resp.raise_for_status()
+        if not resp.content.startswith(b"%PDF"):
+            raise Exception(f"ppubs returned something other than a PDF for {patent_number}")
+        ppubs_browser.remember(patent_number, pdf_url)
+        pdf_cache.put_bytes(pdf_cache.raw_name(patent_number), "raw", resp.content, source=pdf_url)
 
-            with open(log_path, "a") as log:
-                log.write("📥 Raw PDF downloaded.\n")
+        with open(log_path, "a") as log:
+            log.write("📥 Raw PDF downloaded.\n")
 
     except Exception as e:
         with open(log_path, "a") as log:
             log.write(f"❌ Error downloading raw PDF: {e}\n")
+        raise
 import subprocess
 
 @app.route("/ocr_version")
@@ -793,20 +1093,28 @@ def ocr_version():
     result = subprocess.run(["ocrmypdf", "--version"], stdout=subprocess.PIPE, text=True)
     return f"OCR version used by app: {result.stdout}"
 
-#OCR with log
+#OCR with log; runs as a pdf_jobs "ocr" job and raises on failure
 def run_ocr(patent_number):
-    cached_path = os.path.join(PDF_CACHE_DIR, f"{patent_number}.pdf")
-    raw_path = os.path.join(PDF_CACHE_DIR, f"{patent_number}_raw.pdf")
     log_path = os.path.join(PDF_CACHE_DIR, f"{patent_number}.log")
+    name = pdf_cache.ocr_name(patent_number)
+    tmp_path = pdf_cache.temp_path(name)
 
     try:
-        if not os.path.exists(raw_path):
+        raw_path = pdf_cache.lookup(pdf_cache.raw_name(patent_number))
+        if not raw_path:
             raise Exception("Raw PDF missing; cannot OCR.")
 
         with open(log_path, "a") as log:
             log.write("🔧 Starting OCR processing...\n")
 
-        ocrmypdf.ocr(raw_path, cached_path, skip_text=True)
+        ocr_pool.ocr(
+            raw_path, tmp_path,
+            progress=lambda percent, done, pages: pdf_jobs.set_progress(
+                patent_number, "ocr", percent, f"OCR page {done} of {pages}"
+            ),
+        )
+
+        pdf_cache.commit(tmp_path, name, "ocr", source="ocrmypdf")
 
         with open(log_path, "a") as log:
             log.write("✅ OCR complete.\n")
@@ -814,78 +1122,150 @@ def run_ocr(patent_number):
     except Exception as e:
         with open(log_path, "a") as log:
             log.write(f"❌ OCR error: {e}\n")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 #Handles OCR/raw choice from user
 @app.route("/choose_pdf_action/<patent_number>", methods=["POST"])
 def choose_pdf_action(patent_number):
     choice = request.form.get("choice")
     if choice == "ocr":
-        print(f"🚀 Launching OCR thread for {patent_number}")
-        thread = threading.Thread(target=run_ocr, args=(patent_number,), daemon=True)
-        thread.start()
-        print("Thread started")
+        print(f"🚀 Queueing OCR for {patent_number}")
+        try:
+            pdf_jobs.enqueue(patent_number, "ocr")
+        except pdf_jobs.QueueFull as e:
+            return str(e), 503
         return redirect(url_for("ocr_progress", patent_number=patent_number))
     elif choice == "raw":
-        raw_path = os.path.join(PDF_CACHE_DIR, f"{patent_number}_raw.pdf")
-        if os.path.exists(raw_path):
-            return send_file(raw_path, mimetype="application/pdf")
+        raw = send_cached_pdf(pdf_cache.raw_name(patent_number))
+        if raw:
+            return raw
         else:
             return "Raw PDF not found", 404
     else:
         return "Invalid choice", 400
 
-@app.route("/ocr_progress/<patent_number>")
-def ocr_progress(patent_number):
-    print(f"Entered OCR_progress for {patent_number}")
-    log_path = os.path.join(PDF_CACHE_DIR, f"{patent_number}.log")
-    cached_path = os.path.join(PDF_CACHE_DIR, f"{patent_number}.pdf")
+# Seconds between job-state checks on an open progress stream
+PROGRESS_POLL = 1
 
-    log = ""
-    progress = 0
+# A progress stream sends a keep-alive comment after this many quiet seconds
+PROGRESS_KEEPALIVE = 15
 
-    if os.path.exists(log_path):
-        with open(log_path, encoding="utf-8") as f:
-            log = f.read()
-            progress = extract_progress(log)
-    
-    raw_downloaded = "📥 Raw PDF downloaded" in log
-    ocr_started = "🔧 Starting OCR processing" in log
-    ocr_failed  = "❌" in log
-    ocr_done    = os.path.exists(cached_path)
+# Progress streams are closed after this long; EventSource reconnects by itself
+PROGRESS_STREAM_MAX = 30 * 60
 
-    if raw_downloaded and not ocr_started and not ocr_failed and not ocr_done:
-        print("⏳ Waiting for OCR to start...")
+# Where a patent's PDF work stands, for the progress page, its event stream and JSON clients.
+# state is one of waiting, queued, running, downloaded, ready or failed; next is the
+# page to move on to once the work needs nothing more from the server
+def pdf_status(patent_number):
+    cached_path = pdf_cache.lookup(pdf_cache.ocr_name(patent_number), touch=False)
+    raw_path = pdf_cache.lookup(pdf_cache.raw_name(patent_number), touch=False)
 
-    return render_template("processing.html",
-                           patent_number=patent_number,
-                           log=log,
-                           progress=progress,
-                           ready=ocr_done)
+    job = pdf_jobs.latest(patent_number)
+    stage_name = "OCR" if job and job["stage"] == "ocr" else "PDF download"
+    eta = pdf_jobs.eta(job)
+    status = {
+        "patent_number": patent_number,
+        "stage": job["stage"] if job else None,
+        "percent": job["progress"] if job else 0,
+        "detail": job["detail"] if job else None,
+        "queue_position": pdf_jobs.queue_position(job),
+        "eta": int(round(eta / 5) * 5) if eta is not None else None,
+        "error": job["error"] if job else None,
+        "next": None,
+    }
+
+    if cached_path:
+        status.update(state="ready", percent=100, message="✅ Finished.",
+                      next=url_for("download_pdf", patent_number=patent_number))
+    elif raw_path and (not job or (job["stage"] == "download" and job["status"] == "done")):
+        # Raw PDF is in and no OCR was asked for: go back and offer the choice
+        status.update(state="downloaded", percent=100, message="📥 Raw PDF downloaded.",
+                      next=url_for("uspto_pdf", patent_number=patent_number))
+    elif not job:
+        status.update(state="waiting", message="⌛ Waiting for the job to be queued...")
+    elif job["status"] == "queued":
+        place = f" (#{status['queue_position']} in line)" if status["queue_position"] else ""
+        status.update(state="queued", message=f"⌛ {stage_name} queued{place}...")
+    elif job["status"] == "running":
+        icon = "🔧" if job["stage"] == "ocr" else "🔍"
+        status.update(state="running", message=f"{icon} {job['detail'] or stage_name + ' running'}, {job['progress']}% complete...")
+    elif job["status"] == "failed":
+        status.update(state="failed", message=f"❌ Something went wrong during {stage_name}: {job['error']}")
+    else:
+        status.update(state="running", message=f"✅ {stage_name} done.")  # Output about to show up
+    return status
+
+@app.route("/ocr_progress/<patent_number>")
+def ocr_progress(patent_number):
+    return render_template("processing.html", patent_number=patent_number, status=pdf_status(patent_number))
+
+@app.route("/ocr_progress/<patent_number>/status")
+def ocr_progress_status(patent_number):
+    return jsonify(pdf_status(patent_number))
+
+# Server-Sent Events: a "status" event (pdf_status as JSON) each time it changes,
+# ending once the state is ready, downloaded or failed
+@app.route("/ocr_progress/<patent_number>/events")
+def ocr_progress_events(patent_number):
+    @stream_with_context
+    def stream():
+        started = last_sent = time.time()
+        last = None
+        while time.time() - started < PROGRESS_STREAM_MAX:
+            status = pdf_status(patent_number)
+            if status != last:
+                yield f"event: status\ndata: {json.dumps(status)}\n\n"
+                last = status
+                last_sent = time.time()
+                if status["state"] in ("ready", "downloaded", "failed"):
+                    return
+            elif time.time() - last_sent > PROGRESS_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                last_sent = time.time()
+            time.sleep(PROGRESS_POLL)
+
+    return Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # Don't let nginx hold events back
+    })
 
 @app.route("/uspto_pdf_download/<patent_number>")
 def download_pdf(patent_number):
-    cached_path = os.path.join(PDF_CACHE_DIR, f"{patent_number}.pdf")
-    if os.path.exists(cached_path):
-        return send_file(cached_path, mimetype="application/pdf")
+    cached = send_cached_pdf(pdf_cache.ocr_name(patent_number))
+    if cached:
+        return cached
     return "PDF not ready", 404
 #==================================
 
-#render PTAB pdf documents if clicked (assuming URL is /download/<doc id>)
-@app.route("/download/<document_identifier>")
-def download_doc(document_identifier):
+PTAB_DOC_URL = "https://developer.uspto.gov/ptab-api/documents/{}/download"
+
+# Cache name of a PTAB document if it's cached (PDFs and other files are named differently)
+def cached_ptab_doc(document_identifier):
+    for name in (pdf_cache.ptab_doc_name(document_identifier), pdf_cache.ptab_doc_name(document_identifier, pdf=False)):
+        if pdf_cache.lookup(name, touch=False):
+            return name
+    return None
+
+def open_ptab_doc(document_identifier):
     """
-    Proxy download of a PTAB document, but tell the browser to display inline.
+    Starts downloading a PTAB document. Returns (filename, content_type, length, chunks),
+    where length is the upstream Content-Length (None if there isn't one, or if the body
+    came content-encoded, since then it doesn't count the decoded bytes); iterating chunks yields the
+    body while writing it to a temp file, which enters the PDF cache once it's complete.
+    Raises RequestException if the download can't start.
     """
-    dl_url = (
-        "https://developer.uspto.gov/ptab-api/documents/"
-        f"{document_identifier}/download"
+    dl_url = PTAB_DOC_URL.format(document_identifier)
+    # Asked for unencoded, so Content-Length counts the bytes that are passed on and cached
+    resp = uspto_client.get(
+        dl_url, headers={"accept": "application/octet-stream", "Accept-Encoding": "identity"}, stream=True
     )
-    
     try:
-        resp = requests.get(dl_url, headers={"accept": "application/octet-stream"}, timeout=(5, 30))
         resp.raise_for_status()
-    except (RequestException, Timeout, HTTPError) as e:
-        return f"Error downloading document: {e}", 502
+    except HTTPError:
+        resp.close()
+        raise
 
     # 1) Determine filename
     cd = resp.headers.get("Content-Disposition", "")
@@ -898,8 +1278,57 @@ def download_doc(document_identifier):
     else:
         content_type = resp.headers.get("Content-Type", "application/octet-stream")
 
-    # 3) Build Flask response
-    flask_resp = Response(resp.content, content_type=content_type)
+    # 3) Stream it through, keeping a copy; the copy only enters the cache if it's complete
+    name = pdf_cache.ptab_doc_name(document_identifier, pdf=content_type == "application/pdf")
+    expected = None if resp.headers.get("Content-Encoding") else resp.headers.get("Content-Length")
+
+    def generate():
+        tmp_path = pdf_cache.temp_path(name)
+        written = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in resp.iter_content(PTAB_DOC_CHUNK):
+                    f.write(chunk)
+                    written += len(chunk)
+                    yield chunk
+            if expected is None or int(expected) == written:
+                pdf_cache.commit(
+                    tmp_path, name, "ptab_doc", source=dl_url,
+                    filename=filename, content_type=content_type,
+                )
+            else:
+                raise IOError(f"PTAB document {document_identifier} ended at {written} of {expected} bytes")
+        finally:
+            resp.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)  # Client went away or the copy was incomplete
+
+    return filename, content_type, expected, generate()
+
+#render PTAB pdf documents if clicked (assuming URL is /download/<doc id>)
+@app.route("/download/<document_identifier>")
+def download_doc(document_identifier):
+    """
+    Proxy download of a PTAB document, but tell the browser to display inline.
+    PTAB documents never change, so the first open streams the upstream bytes to the
+    browser while saving them to the PDF cache, and later opens are served from disk.
+    """
+    if not re.fullmatch(r"[\w.-]+", document_identifier):
+        return "Invalid document identifier", 400
+
+    name = cached_ptab_doc(document_identifier)
+    cached = send_cached_pdf(name) if name else None
+    if cached:
+        return cached
+
+    try:
+        filename, content_type, length, chunks = open_ptab_doc(document_identifier)
+    except (RequestException, Timeout, HTTPError) as e:
+        return f"Error downloading document: {e}", 502
+
+    flask_resp = Response(chunks, content_type=content_type)
+    if length:
+        flask_resp.headers["Content-Length"] = length
 
     # 4) Tell the browser to render inline
     flask_resp.headers["Content-Disposition"] = (
@@ -908,7 +1337,185 @@ def download_doc(document_identifier):
 
     return flask_resp
 
+# PTAB documents downloaded at once for bundles, across all bundles in this process
+# (each download still takes its turn at the shared PTAB rate limit)
+PTAB_BUNDLE_WORKERS = 4
+_bundle_pool = ThreadPoolExecutor(max_workers=PTAB_BUNDLE_WORKERS, thread_name_prefix="ptab-bundle")
+
+# Downloads a PTAB document into the PDF cache (if it isn't there yet); returns its cache name
+def fetch_ptab_doc(document_identifier):
+    name = cached_ptab_doc(document_identifier)
+    if name:
+        return name
+    _, _, _, chunks = open_ptab_doc(document_identifier)
+    for _ in chunks:
+        pass
+    return cached_ptab_doc(document_identifier)
+
+# Collects what zipfile writes so it can be streamed out as it goes; zipfile only needs
+# write/tell/flush to build an archive on a stream it can't seek
+class ZipStream:
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+# Name for a document inside the bundle: its doc # first so the files sort in docket order
+def bundle_member_name(doc, entry, used):
+    number = str(doc.get("document_number") or "").strip()
+    stem = f"{number.zfill(4)}_" if number.isdigit() else ""
+    filename = entry["filename"] or entry["name"]
+    member = re.sub(r"[^\w.() -]", "_", stem + filename)
+    base, ext = os.path.splitext(member)
+    n = 2
+    while member in used:
+        member = f"{base} ({n}){ext}"
+        n += 1
+    used.add(member)
+    return member
+
+#ZIP of every document in a PTAB proceeding, streamed as each document arrives.
+#Documents are fetched in parallel into the PDF cache, so documents already opened are
+#reused, and rerunning an interrupted bundle only downloads what it hadn't got yet
+@app.route("/ptab_bundle/<proceeding_number>")
+def ptab_bundle(proceeding_number):
+    if not re.fullmatch(r"[\w-]+", proceeding_number):
+        return "Invalid proceeding number", 400
+    documents = [d for d in get_ptab_documents(proceeding_number) if d.get("document_identifier")]
+    if not documents:
+        return f"No documents found for {proceeding_number}", 404
+
+    def generate():
+        stream = ZipStream()
+        used = set()
+        failed = []
+        futures = {}
+        try:
+            with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+                def add(doc, name):
+                    entry = pdf_cache.get(name)
+                    file_path = pdf_cache.lookup(name)
+                    if not entry or not file_path:
+                        raise IOError("dropped from the cache before it could be added")
+                    with open(file_path, "rb") as src, zf.open(bundle_member_name(doc, entry, used), "w", force_zip64=True) as dst:
+                        for block in iter(lambda: src.read(PTAB_DOC_CHUNK), b""):
+                            dst.write(block)
+                            yield stream.take()
+
+                def missing_line(doc, error):
+                    return f"{doc.get('document_number') or '—'}  {doc.get('document_name') or ''}  ({doc['document_identifier']}): {error}"
+
+                for doc in documents:
+                    name = cached_ptab_doc(doc["document_identifier"])
+                    if name:
+                        try:
+                            yield from add(doc, name)
+                        except Exception as e:
+                            failed.append(missing_line(doc, e))
+                    else:
+                        futures[_bundle_pool.submit(fetch_ptab_doc, doc["document_identifier"])] = doc
+                print(f"📦 PTAB bundle {proceeding_number}: {len(documents) - len(futures)} cached, {len(futures)} to download")
+
+                for future in as_completed(futures):
+                    doc = futures[future]
+                    try:
+                        yield from add(doc, future.result())
+                    except Exception as e:
+                        failed.append(missing_line(doc, e))
+
+                if failed:
+                    zf.writestr(
+                        "MISSING_DOCUMENTS.txt",
+                        f"{len(failed)} of {len(documents)} documents could not be downloaded; "
+                        f"download the bundle again to retry just these.\n\n" + "\n".join(failed) + "\n",
+                    )
+            yield stream.take()
+        finally:
+            # Downloads already under way finish into the cache for next time
+            for future in futures:
+                future.cancel()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{proceeding_number}_documents.zip"'},
+    )
+
+CSV_FIELDS = [
+    "assignmentBag.assigneeBag.assigneeNameText",
+    "applicationNumberText",
+    "applicationMetaData.filingDate",
+    "applicationMetaData.effectiveFilingDate",
+    "applicationMetaData.grantDate",
+    "applicationMetaData.pctPublicationDate",
+    "applicationMetaData.applicationStatusDescriptionText",
+    "applicationMetaData.inventionTitle",
+    "applicationMetaData.patentNumber",
+    "applicationMetaData.earliestPublicationNumber",
+    "applicationMetaData.pctPublicationNumber",
+    "applicationMetaData.earliestPublicationDate",
+    "patentTermAdjustmentData.adjustmentTotalQuantity",
+]
+
+CSV_HEADER = [
+    "Patent Number",
+    "Application Number",
+    "Publication Number",
+    "Title",
+    "Filing Date",
+    "Grant Date",
+    "PTA Days",
+    "Status",
+    "Publication Date"
+]
+
+CSV_BASE_URL = "http://eliotpat.com"
+
+# One CSV row for a search hit, with the numbers as hyperlinks back into the app
+def csv_row(pfw, base_url=CSV_BASE_URL):
+    meta = pfw.get("applicationMetaData", {})
+    patent_number = meta.get("patentNumber", "")
+    application_number = pfw.get("applicationNumberText", "")
+    publication_number = meta.get("earliestPublicationNumber") or meta.get("pctPublicationNumber", "")
+
+    # Hyperlink format: =HYPERLINK("http://...","Label")
+    patent_link = f'=HYPERLINK("{base_url}?patent_number={patent_number}", "{patent_number}")' if patent_number else ""
+    app_link = f'=HYPERLINK("{base_url}?application_number={application_number}", "{application_number}")' if application_number else ""
+    pub_link = f'=HYPERLINK("{base_url}?publication_number={publication_number}", "{publication_number}")' if publication_number else ""
+
+    return [
+        patent_link,
+        app_link,
+        pub_link,
+        meta.get("inventionTitle", "(No Title)"),
+        meta.get("filingDate") or meta.get("effectiveFilingDate"),
+        meta.get("grantDate") or meta.get("pctPublicationDate"),
+        pfw.get("patentTermAdjustmentData", {}).get("adjustmentTotalQuantity"),
+        meta.get("applicationStatusDescriptionText", ""),
+        meta.get("earliestPublicationDate") or meta.get("pctPublicationDate")
+    ]
+
 #Return CSV of all results if user clicks from confirm_large_results.html
+#Rows are streamed out page by page as the search pages arrive, so the first bytes
+#go out after the first page and memory stays flat however big the result set is.
+#Post gzip=1 to get the stream gzip-encoded (if the browser accepts gzip).
+#Post background=1 (and format=csv|csv.gz|jsonl) to run it as a resumable background
+#export instead; the user is sent to its status page
 @app.route("/CSV_download", methods=["POST"])
 def csv_download():
     search_term = request.form.get("search_term", "").strip()
@@ -916,166 +1523,368 @@ def csv_download():
     if not search_term:
         return "Missing search term", 400
 
-    try:
-        fields = [
-            "assignmentBag.assigneeBag.assigneeNameText",
-            "applicationNumberText",
-            "applicationMetaData.filingDate",
-            "applicationMetaData.effectiveFilingDate",
-            "applicationMetaData.grantDate",
-            "applicationMetaData.pctPublicationDate",
-            "applicationMetaData.applicationStatusDescriptionText",
-            "applicationMetaData.inventionTitle",
-            "applicationMetaData.patentNumber",
-            "applicationMetaData.earliestPublicationNumber",
-            "applicationMetaData.pctPublicationNumber",
-            "applicationMetaData.earliestPublicationDate",
-            "patentTermAdjustmentData.adjustmentTotalQuantity",
-        ]
-        total, pfws = fetch_all_pages(
-            search_term,
-            fields=fields,
-            limit=None
-        )
+    if request.form.get("background") == "1":
+        try:
+            job_id = export_jobs.create(search_term, request.form.get("format", "csv"))
+        except ValueError as e:
+            return str(e), 400
+        return redirect(url_for("export_status", job_id=job_id))
 
-        si = StringIO()
-        writer = csv.writer(si)
-        writer.writerow([
-            "Patent Number",
-            "Application Number",
-            "Publication Number",
-            "Title",
-            "Filing Date",
-            "Grant Date",
-            "PTA Days",
-            "Status",
-            "Publication Date"
-        ])
-
-        base_url = "http://eliotpat.com"
-
-        for pfw in pfws:
-            meta = pfw.get("applicationMetaData", {})
-            patent_number = meta.get("patentNumber", "")
-            application_number = pfw.get("applicationNumberText", "")
-            publication_number = meta.get("earliestPublicationNumber") or meta.get("pctPublicationNumber", "")
-
-            # Hyperlink format: =HYPERLINK("http://...","Label")
-            patent_link = f'=HYPERLINK("{base_url}?patent_number={patent_number}", "{patent_number}")' if patent_number else ""
-            app_link = f'=HYPERLINK("{base_url}?application_number={application_number}", "{application_number}")' if application_number else ""
-            pub_link = f'=HYPERLINK("{base_url}?publication_number={publication_number}", "{publication_number}")' if publication_number else ""
-
-            writer.writerow([
-                patent_link,
-                app_link,
-                pub_link,
-                meta.get("inventionTitle", "(No Title)"),
-                meta.get("filingDate") or meta.get("effectiveFilingDate"),
-                meta.get("grantDate") or meta.get("pctPublicationDate"),
-                pfw.get("patentTermAdjustmentData", {}).get("adjustmentTotalQuantity"),
-                meta.get("applicationStatusDescriptionText", ""),
-                meta.get("earliestPublicationDate") or meta.get("pctPublicationDate")
-            ])
-
-        return Response(
-            si.getvalue(),
-            mimetype="text/csv",
-            headers={"Content-Disposition": "attachment;filename=bulk_search.csv"}
-        )
+    # Pages go straight out to the client; don't also pile them up in the request memo
+    single_flight.request_memo.set(None)
 
+    pages = iter_search_pages(search_term, fields=CSV_FIELDS, limit=None)
+    try:
+        # Fetch the first page up front so an upstream failure still gets a proper status
+        first = next(pages)
     except RateLimitExceeded:
         return "USPTO API rate limit reached. Please try again later.", 429
     except Exception as e:
         return f"Unexpected error: {e}", 500
 
-# MISC Helper Functions
+    def generate_csv():
+        si = StringIO()
+        writer = csv.writer(si)
+        writer.writerow(CSV_HEADER)
+        rows = 0
+        try:
+            for data in itertools.chain([first], pages):
+                if data is None:
+                    break
+                for pfw in data.get("patentFileWrapperDataBag", []):
+                    writer.writerow(csv_row(pfw))
+                    rows += 1
+                yield si.getvalue()
+                si.seek(0)
+                si.truncate(0)
+        except Exception as e:
+            print(f"❌ CSV export stopped after {rows} rows: {e}")
+            writer.writerow([f"Export stopped early after {rows} rows: {e}"])
+        finally:
+            pages.close()
+        yield si.getvalue()
+
+    headers = {"Content-Disposition": "attachment;filename=bulk_search.csv"}
+    body = generate_csv()
+    wants_gzip = request.form.get("gzip") == "1"
+    if wants_gzip and "gzip" in request.headers.get("Accept-Encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        body = gzip_chunks(body)
+
+    return Response(stream_with_context(body), mimetype="text/csv", headers=headers)
+
+# Gzips a stream of text chunks, flushing after each one so nothing waits on the next page
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+RESULTS_PER_PAGE = 100
+
+#One page of a results table held server-side, sorted and filtered, as JSON
+#Query args: page, per_page, sort (a result_cursors.COLUMNS name), dir (asc|desc),
+#and filters status, assignees, title, filed_from, filed_to, q
+@app.route("/results/<cursor_id>")
+def results_page(cursor_id):
+    cursor = result_cursors.get(cursor_id)
+    if not cursor:
+        return jsonify({"error": "These results have expired; run the search again."}), 404
+
+    filters = {
+        key: request.args.get(key, "").strip()
+        for key in ("status", "assignees", "title", "filed_from", "filed_to", "q")
+    }
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", RESULTS_PER_PAGE, type=int)
+    rows, matched = result_cursors.page(
+        cursor,
+        page=page,
+        per_page=per_page,
+        sort=request.args.get("sort"),
+        direction=request.args.get("dir", "asc"),
+        filters=filters,
+    )
+    return jsonify({
+        "rows": rows,
+        "matched": matched,
+        "count": cursor.count,
+        "page": page,
+        "per_page": per_page,
+    })
+
+#Progress page for a background export
+@app.route("/exports/<job_id>")
+def export_status(job_id):
+    job = export_jobs.get(job_id)
+    if not job:
+        return "Export not found", 404
+    return render_template("export_status.html", job=job, position=export_jobs.queue_position(job_id))
+
+#Same as export_status, as JSON for scripts
+@app.route("/exports/<job_id>/status")
+def export_status_json(job_id):
+    job = export_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Export not found"}), 404
+    return jsonify({
+        "id": job["id"],
+        "query": job["query"],
+        "format": job["format"],
+        "status": job["status"],
+        "rows_written": job["rows_written"],
+        "total": job["total"],
+        "queue_position": export_jobs.queue_position(job_id),
+        "error": job["error"],
+        "download_url": url_for("export_download", job_id=job_id) if job["status"] == "done" else None,
+    })
+
+#Finished export file, served from disk
+@app.route("/exports/<job_id>/download")
+def export_download(job_id):
+    job = export_jobs.get(job_id)
+    if not job or job["status"] != "done" or not os.path.exists(export_jobs.file_path(job)):
+        return "Export not ready", 404
+    return send_file(
+        os.path.abspath(export_jobs.file_path(job)),
+        as_attachment=True,
+        download_name=export_jobs.download_name(job),
+    )
 
-# ✅ PATCH: Replace gather_family_tree to use new continuity endpoint with improved error handling and bag caching
-def gather_family_tree(start_app_number, seen=None, depth=0, max_depth=40):
-    """
-    Recursively walks continuity tree using the dedicated USPTO continuity API:
-    GET /patent/applications/[application_number]/continuity
-    Returns a dict: {app_number: {"bag": ..., "parents": [...], "children": [...]}}
-    """
-    if seen is None:
-        seen = {}
+# Values that live in shared state, read when /metrics is scraped
+@metrics.collector
+def shared_state_metrics():
+    caches = {
+        "response_cache": response_cache.stats(),
+        "result_cursors": result_cursors.stats(),
+        "pdf_cache": pdf_cache.stats(),
+    }
+    lookups = [
+        ({"cache": name, "result": result}, stats[key])
+        for name, stats in caches.items()
+        for key, result in (("hits", "hit"), ("misses", "miss"))
+    ]
+    ratios = [
+        ({"cache": name}, stats["hits"] / (stats["hits"] + stats["misses"]))
+        for name, stats in caches.items()
+        if stats["hits"] + stats["misses"]
+    ]
+    jobs = [({"stage": stage, "status": status}, n) for (stage, status), n in sorted(pdf_jobs.counts().items())]
+    quota = rate_governor.status()
+    return [
+        ("cache_lookups_total", "counter", "Cache lookups in this process by result", lookups),
+        ("cache_hit_ratio", "gauge", "Share of cache lookups in this process that hit", ratios),
+        ("pdf_cache_bytes", "gauge", "Bytes held in the PDF cache", [({}, pdf_cache.total_bytes())]),
+        ("pdf_jobs", "gauge", "PDF download/OCR jobs by stage and status (all processes)", jobs),
+        ("upstream_quota_waiting", "gauge", "Calls waiting on a rate_governor token",
+         [({"upstream": name}, b["waiting"]) for name, b in quota.items()]),
+        ("upstream_quota_tokens", "gauge", "Tokens left in each rate_governor bucket",
+         [({"upstream": name}, b["tokens"]) for name, b in quota.items()]),
+        ("single_flight_in_flight", "gauge", "Shared upstream lookups running right now", [({}, single_flight.in_flight())]),
+    ]
 
-    if depth > max_depth:
-        raise RecursionError(f"🔁 Max depth {max_depth} exceeded while traversing from {start_app_number}")
+#Prometheus text-format metrics: upstream calls, caches, jobs, page timings (see metrics.py)
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
-    if start_app_number in seen:
-        return seen
+#Lets pages that are waiting on a search show "waiting for quota" instead of hanging
+@app.route("/quota_status")
+def quota_status():
+    buckets = rate_governor.status()
+    return jsonify({
+        "waiting": sum(b["waiting"] for b in buckets.values()),
+        "buckets": buckets,
+    })
+
+# MISC Helper Functions
 
-    url = f"https://api.uspto.gov/api/v1/patent/applications/{start_app_number}/continuity"
+# Max continuity lookups in flight at once while walking a family
+FAMILY_TREE_WORKERS = 8
+
+FAMILY_SECONDS = metrics.Histogram("family_walk_seconds", "Time to walk a family and build its members table")
+FAMILY_WALK_SIZE = metrics.Histogram(
+    "family_walk_applications", "Continuity lookups (applications visited) per family walk", buckets=metrics.COUNT_BUCKETS
+)
+FAMILY_MEMBERS = metrics.Histogram(
+    "family_members", "Members shown in a family table", buckets=metrics.COUNT_BUCKETS
+)
+
+# Fetches one application's continuity bag; returns a seen[] entry
+def fetch_continuity(app_number, backoff=None):
+    url = f"https://api.uspto.gov/api/v1/patent/applications/{app_number}/continuity"
     headers = {
         "accept": "application/json",
         "X-API-KEY": API_KEY,
     }
-
-    max_retries = 4
-    delay = 1
-
-    for attempt in range(max_retries):
-        try:
-            #print(f"Checking: {url}")
-            resp = requests.get(url, headers=headers, timeout=(5, 30))
-            resp.raise_for_status()
-            break
-        except requests.HTTPError as e:
-            if resp.status_code == 429:
-                print(f"⚠️ Rate limited on {start_app_number}, sleeping {delay}s")
-                time.sleep(delay)
-                delay *= 2
-                continue
-            elif resp.status_code == 404:
-                print(f"⚠️ Application {start_app_number} not found, skipping.")
-                seen[start_app_number] = {"bag": {}, "parents": [], "children": []}
-                return seen
-            raise
-        except Exception as e:
-            print(f"⚠️ Error in gather_family_tree({start_app_number}): {e}")
-            seen[start_app_number] = {"bag": {}, "parents": [], "children": []}
-            return seen
-    else:
-        raise Exception(f"❌ Failed to fetch continuity for {start_app_number} after {max_retries} attempts")
+    empty = {"bag": {}, "parents": [], "children": []}
+
+    def fetch():
+        #print(f"Checking: {url}")
+        resp = uspto_client.get(url, headers=headers, backoff=backoff)
+        if resp.status_code == 404:
+            print(f"⚠️ Application {app_number} not found, skipping.")
+            return None
+        if resp.status_code == 429:
+            raise RateLimitExceeded(f"❌ Failed to fetch continuity for {app_number}: still rate limited after {uspto_client.MAX_RETRIES} attempts")
+        resp.raise_for_status()
+        return resp.json()
 
     try:
-        data = resp.json()
+        key = response_cache.make_key("continuity", url)
+        data = response_cache.get_or_fetch(
+            "continuity", key, fetch,
+            is_empty=lambda data: not data or not data.get("patentFileWrapperDataBag"),
+        )
+    except (HTTPError, RateLimitExceeded):
+        raise
     except Exception as e:
-        print(f"⚠️ JSON decode error: {e}")
-        seen[start_app_number] = {"bag": {}, "parents": [], "children": []}
-        return seen
+        print(f"⚠️ Error in gather_family_tree({app_number}): {e}")
+        return empty
+
+    if not data:
+        return empty
 
     bags = data.get("patentFileWrapperDataBag", [])
     if not bags:
-        seen[start_app_number] = {"bag": {}, "parents": [], "children": []}
-        return seen
+        return empty
 
     bag = bags[0]
-    parents = bag.get("parentContinuityBag", [])
-    children = bag.get("childContinuityBag", [])
-
-    seen[start_app_number] = {
+    return {
         "bag": bag,
-        "parents": parents,
-        "children": children,
+        "parents": bag.get("parentContinuityBag", []),
+        "children": bag.get("childContinuityBag", []),
     }
 
-    for rel in parents:
-        app_no = rel.get("parentApplicationNumberText")
-        if app_no and app_no not in seen:
-            gather_family_tree(app_no, seen, depth + 1, max_depth)
+def gather_family_tree(start_app_number, seen=None, depth=0, max_depth=40, max_workers=FAMILY_TREE_WORKERS):
+    """
+    Walks the continuity tree breadth-first using the dedicated USPTO continuity API:
+    GET /patent/applications/[application_number]/continuity
+    Each level of the tree is fetched in parallel, at most max_workers at a time.
+    Returns a dict: {app_number: {"bag": ..., "parents": [...], "children": [...]}}
+    """
+    if seen is None:
+        seen = {}
+
+    if start_app_number in seen:
+        return seen
+
+    backoff = uspto_client.SharedBackoff()
+    frontier = [start_app_number]
 
-    for rel in children:
-        app_no = rel.get("childApplicationNumberText")
-        if app_no and app_no not in seen:
-            gather_family_tree(app_no, seen, depth + 1, max_depth)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while frontier:
+            if depth > max_depth:
+                raise RecursionError(f"🔁 Max depth {max_depth} exceeded while traversing from {start_app_number}")
 
-    if depth == 0:
-        print(f"✅ Finished family tree for {start_app_number}, total apps collected: {len(seen)}")
+            fetch = with_current_context(lambda app_no: fetch_continuity(app_no, backoff))
+            entries = list(pool.map(fetch, frontier))
+
+            next_frontier = []
+            for app_no, entry in zip(frontier, entries):
+                seen[app_no] = entry
+            for entry in entries:
+                related = (
+                    [rel.get("parentApplicationNumberText") for rel in entry["parents"]] +
+                    [rel.get("childApplicationNumberText") for rel in entry["children"]]
+                )
+                for app_no in related:
+                    if app_no and app_no not in seen and app_no not in next_frontier:
+                        next_frontier.append(app_no)
+
+            frontier = next_frontier
+            depth += 1
+
+    print(f"✅ Finished family tree for {start_app_number}, total apps collected: {len(seen)}")
+    FAMILY_WALK_SIZE.observe(len(seen))
 
     return seen
 
+# Max application numbers OR'd together in one batched family lookup
+FAMILY_BATCH_SIZE = 50
+
+# Builds the family members table from the bags gather_family_tree already fetched.
+# The continuity relationships carry patent # and filing date of each related app, so
+# usually only titles are missing; those members are looked up together in one
+# applicationNumberText:(a OR b OR ...) search instead of one request per member
+def build_family_members(family_tree, self_app_number):
+    rows = {}
+    for app_no, entry in family_tree.items():
+        if app_no == self_app_number:
+            continue  # Skip self
+        meta = (entry.get("bag") or {}).get("applicationMetaData", {})
+        rows[app_no] = {
+            "application_number": app_no,
+            "patent_number": meta.get("patentNumber") or meta.get("pctPublicationNumber") or "",
+            "title": meta.get("inventionTitle") or "",
+            "filing_date": meta.get("filingDate") or meta.get("effectiveFilingDate") or "",
+        }
+
+    def fill(app_no, patent_number, filing_date):
+        row = rows.get(app_no)
+        if not row:
+            return
+        row["patent_number"] = row["patent_number"] or patent_number or ""
+        row["filing_date"] = row["filing_date"] or filing_date or ""
+
+    for entry in family_tree.values():
+        for p in entry.get("parents", []):
+            fill(p.get("parentApplicationNumberText"), p.get("parentPatentNumber"), p.get("parentApplicationFilingDate"))
+        for c in entry.get("children", []):
+            fill(c.get("childApplicationNumberText"), c.get("childPatentNumber"), c.get("childApplicationFilingDate"))
+
+    def fill_from(row, pfw):
+        meta = pfw.get("applicationMetaData", {})
+        row["title"] = row["title"] or meta.get("inventionTitle") or ""
+        row["patent_number"] = row["patent_number"] or meta.get("patentNumber") or meta.get("pctPublicationNumber") or ""
+        row["filing_date"] = row["filing_date"] or meta.get("filingDate") or meta.get("effectiveFilingDate") or ""
+
+    missing = [
+        app_no for app_no, row in rows.items()
+        if not (row["title"] and row["patent_number"] and row["filing_date"])
+    ]
+    # Only plain application #s can be OR'd into one applicationNumberText query; PCT
+    # application #s and anything else are looked up one at a time below
+    numeric = [app_no for app_no in missing if re.fullmatch(r"\d+", app_no)]
+    for i in range(0, len(numeric), FAMILY_BATCH_SIZE):
+        batch = numeric[i:i + FAMILY_BATCH_SIZE]
+        q = f"applicationNumberText:({' OR '.join(batch)})"
+        try:
+            print(f"Fetching {len(batch)} family members in one batch")
+            _, pfws = fetch_all_pages(q, fields=FIELD_PROFILES["family-row"], limit=len(batch))
+        except Exception as e:
+            print(f"⚠️ Could not fetch family member details for {batch}: {e}")
+            continue
+        for pfw in pfws:
+            if not isinstance(pfw, dict):
+                continue
+            row = rows.get(pfw.get("applicationNumberText"))
+            if row:
+                fill_from(row, pfw)
+
+    for app_no in (app_no for app_no in missing if app_no not in numeric):
+        if re.match(r"^PCT/[A-Z]{2}\d{4}/\d{6}$", app_no, re.IGNORECASE):
+            q = f"applicationMetaData.pctPublicationNumber:{app_no}"
+        else:
+            q = f"applicationNumberText:{app_no}"
+        try:
+            print(f"Fetching family member {app_no}")
+            _, pfws = fetch_all_pages(q, fields=FIELD_PROFILES["family-row"], limit=1)
+        except Exception as e:
+            print(f"⚠️ Could not fetch family member details for {app_no}: {e}")
+            continue
+        if pfws and isinstance(pfws[0], dict):
+            fill_from(rows[app_no], pfws[0])
+
+    for row in rows.values():
+        row["title"] = row["title"] or "(No Title)"
+        row["filing_date"] = row["filing_date"] or "—"
+
+    FAMILY_MEMBERS.observe(len(rows))
+    return list(rows.values())
+
 def sort_family_members(members):
     def sort_key(member):
         app_num = member.get("application_number", "")
@@ -1088,28 +1897,27 @@ def sort_family_members(members):
             return (0, float("inf"))
     return sorted(members, key=sort_key)
 
-def extract_progress(log_text):
-    # Look for last occurrence of "NN%" (e.g., 65%) in the log
-    matches = re.findall(r'(\d{1,3})%', log_text)
-    if matches:
-        return int(matches[-1])
-    return 0
+class RateLimitExceeded(Exception):
+    pass
 
-def parse_doc_number(s):
-            try:
-                return int(s)
-            except Exception:
-                return -1
+# Starts this server process's background work. Called from the server entry point rather
+# than on import, so scripts and tests that import app don't start threads or syncs; a
+# WSGI entry point should call it once in each worker process
+def start_background_work():
+    # Keep the local PTAB proceedings index current (see ptab_index)
+    if PTAB_INDEX_SYNC_INTERVAL:
+        ptab_index.start_background_sync(PTAB_INDEX_SYNC_INTERVAL)
 
-def parse_date(s):
-    try:
-        return parser.parse(s)
-    except Exception:
-        return datetime.max
+    # Background export worker for this process (see export_jobs)
+    export_jobs.start_worker(fetch_search_page, CSV_FIELDS, CSV_HEADER, csv_row)
 
-class RateLimitExceeded(Exception):
-    pass
+    # Tidy the PDF cache after any crash, then start PDF download and OCR workers (see pdf_cache, pdf_jobs)
+    pdf_cache.start_repair()
+    pdf_jobs.start_workers({"download": download_raw_pdf, "ocr": run_ocr})
 
 
 if __name__ == "__main__":
+    # With debug=True the reloader runs this file twice; only the serving child gets the workers
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_work()
     app.run(host="0.0.0.0", port=5000, debug=True)
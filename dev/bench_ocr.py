@@ -0,0 +1,78 @@
+# bench_ocr.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Times single-call OCR against split-and-merge OCR (see ocr_pool) on sample PDFs
+# of several page counts, built by repeating the pages of the PDFs given.
+#
+#   python dev/bench_ocr.py sample1.pdf [sample2.pdf ...] [--pages 10,40,100,300] [--chunk 10]
+#
+# Samples should be scanned (image-only) PDFs, e.g. raw ppubs downloads from
+# uspto_pdf_cache/*_raw.pdf, or the skip-text shortcut makes both paths look free.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pikepdf
+
+import ocr_pool
+
+
+# Writes a PDF of exactly `pages` pages by cycling through the sample's pages
+def build_sample(sample, pages, path):
+    with pikepdf.open(sample) as src, pikepdf.new() as dst:
+        for i in range(pages):
+            dst.pages.append(src.pages[i % len(src.pages)])
+        dst.save(path)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare single-call and split-and-merge OCR times")
+    ap.add_argument("samples", nargs="+")
+    ap.add_argument("--pages", default="10,40,100,300")
+    ap.add_argument("--chunk", type=int, default=ocr_pool.CHUNK_PAGES)
+    args = ap.parse_args()
+
+    print(f"{ocr_pool.CORES} cores, {ocr_pool.JOBS_PER_RUN} per run, {args.chunk} pages per chunk")
+    print(f"{'sample':<30} {'pages':>6} {'single s':>9} {'split s':>9} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as work:
+        # Warm both pools so process start-up isn't billed to the first row
+        warm = os.path.join(work, "warm.pdf")
+        build_sample(args.samples[0], 1, warm)
+        ocr_pool.ocr_single(warm, warm + ".out")
+        ocr_pool.ocr_split(warm, warm + ".out", chunk_pages=args.chunk)
+
+        for sample in args.samples:
+            for pages in (int(p) for p in args.pages.split(",")):
+                raw = os.path.join(work, f"raw_{pages}.pdf")
+                build_sample(sample, pages, raw)
+                single = timed(ocr_pool.ocr_single, raw, raw + ".single.pdf")
+                split = timed(ocr_pool.ocr_split, raw, raw + ".split.pdf", chunk_pages=args.chunk)
+                print(f"{os.path.basename(sample)[:30]:<30} {pages:>6} {single:>9.1f} {split:>9.1f} {single / split:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
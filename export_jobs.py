@@ -0,0 +1,361 @@
+# export_jobs.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Resumable background bulk exports of a search (CSV, gzipped CSV or JSONL).
+#
+# Job state lives in SQLite and rows go to a .part file on disk. After every page
+# the job checkpoints the next offset, rows written and the exact byte length of the
+# .part file. A job interrupted by a crash or restart is picked up again by any
+# worker once its lease runs out: the .part file is truncated back to the last
+# checkpoint and paging carries on from there.
+#
+# A worker keeps renewing its lease while it waits on a page (quota waits and
+# Retry-After pauses can be long). Each claim gets its own lease token, and a page
+# is only written and checkpointed if the worker still holds that token and the
+# job is still at the offset it fetched; otherwise the page is thrown away.
+#
+# Workers take one page from one job at a time, always from the job that has gone
+# longest without progress, so several queued exports share quota round-robin. All
+# of their upstream calls run with rate_governor.background set, so they never
+# take the quota interactive searches need.
+
+import csv
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from io import StringIO
+
+import rate_governor
+
+STATE_DIR = "uspto_state"
+os.makedirs(STATE_DIR, exist_ok=True)
+DB_PATH = os.path.join(STATE_DIR, "export_jobs.db")
+
+EXPORT_DIR = "uspto_exports"
+os.makedirs(EXPORT_DIR, exist_ok=True)
+
+# Output formats: file extension for each
+FORMATS = {
+    "csv": "csv",
+    "csv.gz": "csv.gz",
+    "jsonl": "jsonl",
+}
+
+PAGE_SIZE = 100
+
+# A worker holds a job for this long per page; if it dies, another worker resumes it
+LEASE = 120
+
+# Failed pages are retried with growing pauses, up to this many times in a row
+MAX_ATTEMPTS = 8
+
+# Idle workers check for new jobs this often
+POLL_INTERVAL = 2
+
+# Finished exports (and their files) are deleted after this long
+RETENTION = 7 * 24 * 3600
+
+_local = threading.local()
+_started = False
+_started_lock = threading.Lock()
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS exports (
+                id TEXT PRIMARY KEY,
+                query TEXT,
+                format TEXT,
+                status TEXT,
+                total INTEGER,
+                next_offset INTEGER DEFAULT 0,
+                rows_written INTEGER DEFAULT 0,
+                bytes_written INTEGER DEFAULT 0,
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                created REAL,
+                updated REAL,
+                lease_until REAL DEFAULT 0,
+                lease_owner TEXT,
+                not_before REAL DEFAULT 0
+            )
+        """)
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(exports)")]
+        if "lease_owner" not in columns:
+            conn.execute("ALTER TABLE exports ADD COLUMN lease_owner TEXT")
+        _local.conn = conn
+    return conn
+
+
+def _part_path(job):
+    return os.path.join(EXPORT_DIR, f"{job['id']}.part")
+
+
+def file_path(job):
+    return os.path.join(EXPORT_DIR, f"{job['id']}.{FORMATS[job['format']]}")
+
+
+def download_name(job):
+    return f"bulk_search_{job['id']}.{FORMATS[job['format']]}"
+
+
+def get(job_id):
+    row = _connect().execute("SELECT * FROM exports WHERE id = ?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def create(query, fmt="csv"):
+    """
+    Queues an export of query, or returns the id of an identical one still in progress.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    conn = _connect()
+    row = conn.execute(
+        "SELECT id FROM exports WHERE query = ? AND format = ? AND status IN ('queued', 'running')",
+        (query, fmt),
+    ).fetchone()
+    if row:
+        return row["id"]
+
+    job_id = uuid.uuid4().hex[:12]
+    now = time.time()
+    conn.execute(
+        "INSERT INTO exports (id, query, format, status, created, updated) VALUES (?, ?, ?, 'queued', ?, ?)",
+        (job_id, query, fmt, now, now),
+    )
+    print(f"📦 Queued {fmt} export {job_id} for: {query}")
+    return job_id
+
+
+# Position of a queued/running job among all unfinished exports (1 = next up)
+def queue_position(job_id):
+    job = get(job_id)
+    if not job or job["status"] not in ("queued", "running"):
+        return 0
+    return _connect().execute(
+        "SELECT COUNT(*) FROM exports WHERE status IN ('queued', 'running') AND created <= ?",
+        (job["created"],),
+    ).fetchone()[0]
+
+
+# Claims the runnable job that has gone longest without progress
+def _claim():
+    conn = _connect()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT * FROM exports WHERE status IN ('queued', 'running')"
+            " AND lease_until < ? AND not_before <= ? ORDER BY updated LIMIT 1",
+            (now, now),
+        ).fetchone()
+        owner = uuid.uuid4().hex
+        if row:
+            conn.execute(
+                "UPDATE exports SET status = 'running', lease_until = ?, lease_owner = ? WHERE id = ?",
+                (now + LEASE, owner, row["id"]),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return dict(row, lease_owner=owner) if row else None
+
+
+def _renew_lease(job, stop):
+    while not stop.wait(LEASE / 3):
+        try:
+            renewed = _connect().execute(
+                "UPDATE exports SET lease_until = ? WHERE id = ? AND lease_owner = ?",
+                (time.time() + LEASE, job["id"], job["lease_owner"]),
+            ).rowcount
+            if not renewed:
+                print(f"⚠️ Export {job['id']} lease was taken over; this worker's page will be dropped")
+                return
+        except sqlite3.Error as e:
+            print(f"⚠️ Could not renew lease on export {job['id']}: {e}")
+
+
+def _format_rows(job, pfws, csv_header, csv_row):
+    if job["format"] == "jsonl":
+        return "".join(json.dumps(pfw) + "\n" for pfw in pfws)
+    si = StringIO()
+    writer = csv.writer(si)
+    if job["next_offset"] == 0:
+        writer.writerow(csv_header)
+    for pfw in pfws:
+        writer.writerow(csv_row(pfw))
+    return si.getvalue()
+
+
+def _finish(job):
+    part = _part_path(job)
+    final = file_path(job)
+    if job["format"] == "csv.gz":
+        with open(part, "rb") as src, gzip.open(final + ".tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(final + ".tmp", final)
+        os.remove(part)
+    else:
+        os.replace(part, final)
+
+
+class LeaseLost(Exception):
+    pass
+
+
+# Fetches one page for job, then writes and checkpoints it if the job is still ours
+def _step(job, fetch_page, fields, csv_header, csv_row):
+    part = _part_path(job)
+    claimed_offset = job["next_offset"]
+    if not os.path.exists(part) and job["bytes_written"]:
+        if os.path.exists(file_path(job)):
+            # Died between finishing the file and recording it
+            _connect().execute(
+                "UPDATE exports SET status = 'done', updated = ?, lease_until = 0 WHERE id = ? AND lease_owner = ?",
+                (time.time(), job["id"], job["lease_owner"]),
+            )
+            return
+        print(f"⚠️ Export {job['id']} lost its partial file, starting over")
+        job.update(next_offset=0, rows_written=0, bytes_written=0)
+
+    offset = job["next_offset"]
+    stop = threading.Event()
+    threading.Thread(target=_renew_lease, args=(job, stop), daemon=True).start()
+    try:
+        data = fetch_page(job["query"], offset, PAGE_SIZE, fields)
+    finally:
+        stop.set()
+    pfws = data.get("patentFileWrapperDataBag", []) if data else []
+    total = data.get("count", 0) if data else 0
+    rows = _format_rows(job, pfws, csv_header, csv_row).encode("utf-8")
+
+    # The write lock is held from the ownership check to the checkpoint, so only the
+    # worker holding the lease ever touches the job's files
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT status, lease_owner, next_offset FROM exports WHERE id = ?", (job["id"],)
+        ).fetchone()
+        if not row or row["status"] != "running" or row["lease_owner"] != job["lease_owner"] or row["next_offset"] != claimed_offset:
+            raise LeaseLost(f"Export {job['id']} was taken over while fetching offset {offset}; dropping the page")
+
+        existing = os.path.getsize(part) if os.path.exists(part) else 0
+        if existing < job["bytes_written"]:
+            raise IOError(f"Export {job['id']} partial file is shorter than its last checkpoint")
+        with open(part, "r+b" if os.path.exists(part) else "wb") as f:
+            f.truncate(job["bytes_written"])  # Drop anything written after the last checkpoint
+            f.seek(job["bytes_written"])
+            f.write(rows)
+            f.flush()
+            os.fsync(f.fileno())
+            bytes_written = f.tell()
+
+        next_offset = offset + PAGE_SIZE
+        done = not pfws or next_offset >= total
+        if done:
+            _finish(job)
+        conn.execute(
+            "UPDATE exports SET status = ?, total = ?, next_offset = ?, rows_written = ?,"
+            " bytes_written = ?, attempts = 0, error = NULL, updated = ?, lease_until = 0, lease_owner = NULL"
+            " WHERE id = ?",
+            (
+                "done" if done else "running", total, next_offset,
+                job["rows_written"] + len(pfws), bytes_written, time.time(), job["id"],
+            ),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if done:
+        print(f"✅ Export {job['id']} finished: {job['rows_written'] + len(pfws)} rows")
+
+
+def _record_failure(job, error):
+    attempts = job["attempts"] + 1
+    failed = attempts >= MAX_ATTEMPTS
+    recorded = _connect().execute(
+        "UPDATE exports SET status = ?, attempts = ?, error = ?, updated = ?, lease_until = 0, lease_owner = NULL,"
+        " not_before = ? WHERE id = ? AND lease_owner = ?",
+        (
+            "failed" if failed else "running", attempts, str(error), time.time(),
+            time.time() + min(2 ** attempts, 300), job["id"], job["lease_owner"],
+        ),
+    ).rowcount
+    if not recorded:
+        return  # Another worker holds the job now
+    print(f"{'❌' if failed else '⚠️'} Export {job['id']} page at offset {job['next_offset']} failed: {error}")
+
+
+def _purge_old():
+    conn = _connect()
+    cutoff = time.time() - RETENTION
+    for row in conn.execute(
+        "SELECT * FROM exports WHERE status IN ('done', 'failed') AND updated < ?", (cutoff,)
+    ).fetchall():
+        for path in (file_path(row), _part_path(row)):
+            if os.path.exists(path):
+                os.remove(path)
+        conn.execute("DELETE FROM exports WHERE id = ?", (row["id"],))
+
+
+def start_worker(fetch_page, fields, csv_header, csv_row):
+    """
+    Starts this process's export worker thread (once).
+    fetch_page(q, offset, page_size, fields) must return the search response dict, or None on 404.
+    """
+    global _started
+    with _started_lock:
+        if _started:
+            return
+        _started = True
+
+    def loop():
+        rate_governor.background.set(True)
+        last_purge = 0
+        while True:
+            try:
+                if time.time() - last_purge > 3600:
+                    _purge_old()
+                    last_purge = time.time()
+                job = _claim()
+                if not job:
+                    time.sleep(POLL_INTERVAL)
+                    continue
+                try:
+                    _step(job, fetch_page, fields, csv_header, csv_row)
+                except LeaseLost as e:
+                    print(f"⚠️ {e}")
+                except Exception as e:
+                    _record_failure(job, e)
+            except Exception as e:
+                print(f"❌ Export worker error: {e}")
+                time.sleep(POLL_INTERVAL)
+
+    threading.Thread(target=loop, name="export-worker", daemon=True).start()
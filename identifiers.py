@@ -0,0 +1,91 @@
+# identifiers.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Recognizes and normalizes patent, application, publication and PTAB docket numbers
+# the way people type or paste them.
+#
+# normalize(value) is the one set of rules; the search box (app.classify_identifier)
+# and PTAB lookups (app.classify_ptab_identifier) each map its kinds onto their own.
+
+import re
+
+# 8-digit numbers that are both current patent #s and application #s of series 10-12
+AMBIGUOUS_PATENT_NUMBER = re.compile(r"1[0-2]\d{6}")
+
+# Application series codes that never collide with patent #s: utility 08-19, design 29,
+# provisional 60-63, and reexam / supplemental exam control #s 90, 95 and 96
+APPLICATION_SERIES = re.compile(r"(0[89]|1[3-9]|29|6[0-3]|9[056])\d{6}")
+
+
+# Works out whether value is one exact identifier and normalizes it. Accepts e.g. 6708213,
+# US 6,708,213 B2, RE45,123, 16/123,456, 08123456, 90/012,345 (reexam), US 2019/0123456 A1,
+# WO 2019/123456, PCT/US2019/012345 and IPR2020-00001 / ipr 2014-342. Returns (kind, value)
+# with kind one of:
+#   "docket"                 PTAB docket #, e.g. IPR2014-00342
+#   "pct"                    PCT application #, e.g. PCT/US2019/012345
+#   "wo"                     WO publication #, e.g. WO2019123456
+#   "application"            US application or reexam control #, e.g. 16123456
+#   "publication"            US publication #, e.g. US20190123456A1
+#   "patent"                 patent #, e.g. 6708213, RE45123
+#   "patent_or_application"  bare 8 digits of series 10-12, which can be either
+#   "number"                 bare 5-6 digits: an old patent #, or maybe just text
+# or (None, value) if it's none of these
+def normalize(value):
+    value = str(value or "").strip()
+    upper = re.sub(r"\s+", " ", value.upper())
+
+    m = re.fullmatch(r"([A-Z]+) ?(\d{4}) ?- ?(\d+)", upper)
+    if m:
+        return "docket", f"{m.group(1)}{m.group(2)}-{m.group(3).zfill(5)}"
+
+    # PCT/CCYYYY/NNNNNN, or PCT/CCYY/NNNNN before 2004
+    m = re.fullmatch(r"PCT ?/? ?([A-Z]{2}) ?(\d{4}|\d{2}) ?/ ?(\d{1,6})", upper)
+    if m:
+        width = 6 if len(m.group(2)) == 4 else 5
+        return "pct", f"PCT/{m.group(1)}{m.group(2)}/{m.group(3).zfill(width)}"
+
+    m = re.fullmatch(r"WO ?(\d{4}) ?/? ?(\d{6})( ?A\d)?", upper)
+    if m:
+        return "wo", f"WO{m.group(1)}{m.group(2)}"
+
+    compact = re.sub(r"[\s,]", "", upper)
+    m = re.fullmatch(r"(?:US)?(\d{2})/(\d{6})", compact)
+    if m:
+        return "application", m.group(1) + m.group(2)
+
+    m = re.fullmatch(r"(?:US)?((?:19|20)\d{2})/?(\d{6,7})(A\d)?", compact)
+    if m and (m.group(3) or "/" in compact or compact.startswith("US") or len(m.group(2)) == 7):
+        return "publication", f"US{m.group(1)}{m.group(2).zfill(7)}{m.group(3) or 'A1'}"
+
+    m = re.fullmatch(r"(?:US)?(RE|D|PP)0*(\d{1,6})(E|S|P\d)?", compact)
+    if m:
+        return "patent", m.group(1) + m.group(2)
+
+    m = re.fullmatch(r"(US)?(\d{5,})([AB]\d)?", compact)
+    if m:
+        digits = m.group(2)
+        # Checked before zeros are stripped: 08123456 is an application, not patent 8123456
+        if not m.group(3) and len(digits) == 8 and APPLICATION_SERIES.fullmatch(digits):
+            return "application", digits
+        number = digits.lstrip("0")
+        if 5 <= len(number) <= 8:
+            if m.group(1) or m.group(3):
+                return "patent", number
+            if AMBIGUOUS_PATENT_NUMBER.fullmatch(number):
+                return "patent_or_application", number
+            return ("patent" if len(number) >= 7 else "number"), number
+
+    return None, value
@@ -0,0 +1,196 @@
+# metrics.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# In-process counters and histograms, served at /metrics in the Prometheus text format,
+# plus per-request stage timings for the Server-Timing header.
+#
+# Counters and histograms are kept in memory per process, so with several WSGI
+# workers each one reports its own (scrape them separately or sum them). Numbers
+# that live in shared state anyway (job queues, cache hit counts) are read when
+# /metrics is rendered, by collector functions registered with collector().
+#
+# Stage timings: start_request() gives the current request (and threads running in a
+# copy of its context) a fresh set of stages; timed(stage) / add_timing() add to it,
+# and server_timing() turns it into the header. Time spent in parallel threads adds
+# up, so a stage can report more time than the request took.
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Buckets for durations of background jobs, in seconds
+JOB_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# Buckets for counts (family members, upstream calls per page)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_metrics = []
+_collectors = []
+_lock = threading.Lock()
+
+# Current request's stage timings: {stage: [seconds, calls]}
+_timings = contextvars.ContextVar("metrics_timings", default=None)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        with _lock:
+            _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _lines(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_label_text(dict(zip(self.labels, key)))} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}  # key -> [bucket counts..., sum, count]
+        with _lock:
+            _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with _lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def _lines(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, state in sorted(self._values.items()):
+            labels = dict(zip(self.labels, key))
+            for bound, count in zip(self.buckets, state):
+                yield f"{self.name}_bucket{_label_text(dict(labels, le=_number(bound)))} {count}"
+            yield f"{self.name}_sum{_label_text(labels)} {_number(state[-2])}"
+            yield f"{self.name}_count{_label_text(labels)} {state[-1]}"
+
+
+def collector(fn):
+    """
+    Registers fn() -> [(name, type, help, [(labels dict, value), ...]), ...], called on
+    every render() for values read from elsewhere (e.g. SQLite). Usable as a decorator.
+    """
+    with _lock:
+        _collectors.append(fn)
+    return fn
+
+
+def render():
+    """
+    Every metric in the Prometheus text exposition format.
+    """
+    with _lock:
+        lines = [line for metric in _metrics for line in metric._lines()]
+        collectors = list(_collectors)
+    for fn in collectors:
+        try:
+            families = fn()
+        except Exception as e:
+            print(f"⚠️ Metrics collector {fn.__name__} failed: {e}")
+            continue
+        for name, kind, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_label_text(labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# Gives the current request a fresh set of stage timings
+def start_request():
+    _timings.set({})
+
+
+def add_timing(stage, seconds, calls=1):
+    timings = _timings.get()
+    if timings is None:
+        return
+    with _lock:
+        entry = timings.setdefault(stage, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += calls
+
+
+# Calls made to stage so far in this request
+def calls(stage):
+    timings = _timings.get() or {}
+    return timings.get(stage, [0.0, 0])[1]
+
+
+@contextmanager
+def timed(stage, histogram=None, **labels):
+    """
+    Adds the time spent in the block to the request's stage (and to histogram, if given).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        add_timing(stage, elapsed)
+        if histogram is not None:
+            histogram.observe(elapsed, **labels)
+
+
+def server_timing(total=None):
+    """
+    The request's stages as a Server-Timing header value, e.g.
+    uspto;dur=812.4;desc="3 calls", render;dur=35.0, total;dur=901.2
+    """
+    timings = _timings.get() or {}
+    parts = []
+    for stage, (seconds, count) in timings.items():
+        desc = f';desc="{count} calls"' if count > 1 else ""
+        parts.append(f"{stage};dur={seconds * 1000:.1f}{desc}")
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
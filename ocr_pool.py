@@ -0,0 +1,180 @@
+# ocr_pool.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Runs ocrmypdf with a fixed number of runs at once, sized to the cores this box gives us.
+#
+# The cores are split into SLOTS equal shares of at least CORES_PER_JOB, and each
+# OCR run gets one share through ocrmypdf's `jobs` setting, so several patents
+# OCRing at once never ask for more cores than exist. pdf_jobs runs at most SLOTS
+# OCR jobs at a time (across all processes), so the shares add up to the box.
+#
+# Each run is an ocrmypdf subprocess started from a bounded thread pool, rather than
+# ocrmypdf.ocr() in an app thread: ocrmypdf starts its own process pool and changes
+# logging/signal state, which doesn't mix with a threaded web server, and a
+# multiprocessing pool would re-run app.py's start-up in every worker.
+#
+# Big documents are split instead: the raw PDF is cut into CHUNK_PAGES page ranges,
+# up to a run's share of chunks are OCRed at once (one core each, including the
+# steps ocrmypdf runs single-threaded), and the results are merged back in page
+# order. Chunks whose pages all have a text layer already are copied as they are.
+# Compare the two paths with dev/bench_ocr.py.
+
+import os
+import shutil
+import subprocess
+import tempfile
+from contextlib import ExitStack
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pikepdf
+
+
+def _available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+CORES = _available_cores()
+
+# Smallest core share worth giving one OCR run; below this, jobs just wait their turn
+CORES_PER_JOB = 4
+
+# OCR runs allowed at once
+SLOTS = max(1, CORES // CORES_PER_JOB)
+
+# ocrmypdf `jobs` for each run
+JOBS_PER_RUN = max(1, CORES // SLOTS)
+
+# Documents with at least this many pages are OCRed in chunks (if a run has more than one core)
+SPLIT_MIN_PAGES = 40
+
+# Pages per chunk when splitting
+CHUNK_PAGES = 10
+
+# Lines of ocrmypdf's output kept in the error when a run fails
+ERROR_TAIL = 5
+
+# Thread pools starting ocrmypdf runs: one for whole documents, one for chunks
+_run_pool = ThreadPoolExecutor(max_workers=SLOTS, thread_name_prefix="ocr-run")
+_chunk_pool = ThreadPoolExecutor(max_workers=CORES, thread_name_prefix="ocr-chunk")
+
+
+def _ocr(raw_path, out_path, jobs, output_type=None):
+    cmd = ["ocrmypdf", "--skip-text", "--jobs", str(jobs), "--quiet"]
+    if output_type:
+        cmd += ["--output-type", output_type]
+    result = subprocess.run(cmd + [raw_path, out_path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        tail = "\n".join(result.stdout.strip().splitlines()[-ERROR_TAIL:])
+        raise Exception(f"ocrmypdf exited with {result.returncode}: {tail}")
+
+
+def _has_text(page):
+    try:
+        resources = page.obj.get("/Resources") or {}
+        return bool(resources.get("/Font"))
+    except Exception:
+        return False
+
+
+def page_count(path):
+    with pikepdf.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def ocr_single(raw_path, out_path):
+    """
+    OCRs the whole document in one ocrmypdf run with this run's share of cores.
+    """
+    _run_pool.submit(_ocr, raw_path, out_path, JOBS_PER_RUN).result()
+
+
+def ocr_split(raw_path, out_path, progress=None, chunk_pages=CHUNK_PAGES, parallel=JOBS_PER_RUN):
+    """
+    OCRs the document in chunks of chunk_pages pages, `parallel` chunks at a time,
+    then merges them into out_path. progress(percent, pages_done, pages) is called
+    as chunks finish.
+    """
+    # Work next to out_path, named after it, so whoever cleans up its temp files also finds these
+    out_path = os.path.abspath(out_path)
+    work = tempfile.mkdtemp(prefix=os.path.basename(out_path) + ".chunks-", dir=os.path.dirname(out_path))
+    try:
+        chunks = []
+        with pikepdf.open(raw_path) as pdf:
+            for start in range(0, len(pdf.pages), chunk_pages):
+                pages = pdf.pages[start:start + chunk_pages]
+                path = os.path.join(work, f"{start:06d}.pdf")
+                with pikepdf.new() as chunk:
+                    chunk.pages.extend(pages)
+                    chunk.save(path)
+                chunks.append((path, len(pages), all(_has_text(page) for page in pages)))
+
+        total_pages = sum(count for _, count, _ in chunks)
+        outputs = []
+        todo = []
+        for path, count, has_text in chunks:
+            if has_text:
+                outputs.append(path)  # Nothing to OCR; keep the pages as they are
+            else:
+                outputs.append(path + ".ocr.pdf")
+                todo.append((path, path + ".ocr.pdf", count))
+
+        pages_done = total_pages - sum(count for _, _, count in todo)
+
+        def report():
+            if progress:
+                # The last chunk's worth of progress is left for merging
+                progress(pages_done * 100 // (total_pages + chunk_pages), pages_done, total_pages)
+
+        report()
+        in_flight = {}
+        try:
+            while todo or in_flight:
+                while todo and len(in_flight) < parallel:
+                    src, dst, count = todo.pop(0)
+                    # The merged file isn't PDF/A anyway, so skip the PDF/A conversion per chunk
+                    in_flight[_chunk_pool.submit(_ocr, src, dst, 1, output_type="pdf")] = count
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                    pages_done += in_flight.pop(future)
+                report()
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+        # Pages are only copied on save, so every chunk stays open until then
+        with ExitStack() as stack:
+            merged = stack.enter_context(pikepdf.new())
+            for path in outputs:
+                merged.pages.extend(stack.enter_context(pikepdf.open(path)).pages)
+            merged.save(out_path + ".tmp")
+        os.replace(out_path + ".tmp", out_path)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def ocr(raw_path, out_path, progress=None):
+    """
+    OCRs raw_path into out_path with this run's share of cores, splitting big
+    documents into chunks. Blocks until done.
+    """
+    if JOBS_PER_RUN > 1 and page_count(raw_path) >= SPLIT_MIN_PAGES:
+        ocr_split(raw_path, out_path, progress)
+    else:
+        ocr_single(raw_path, out_path)
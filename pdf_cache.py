@@ -0,0 +1,342 @@
+# pdf_cache.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Managed on-disk cache of PDFs (raw ppubs downloads, OCR'd copies and PTAB documents).
+#
+# Files are written under a temporary name and renamed into place, so a file that
+# exists under its real name is always complete. Every file has a row in a SQLite
+# index (kind, size, checksum, source, last access, and the filename/content type
+# to serve it with); lookups only return files the index knows about and whose size
+# still matches. The cache is held under MAX_BYTES by dropping least recently used
+# raw copies first, then PTAB documents, then OCR'd patents.
+#
+# repair() (run at start-up) removes stale temp files, forgets index rows whose
+# file is gone, adopts intact PDFs the index doesn't know, deletes truncated ones,
+# and clears out old logs with no PDF left. From the command line:
+#   python pdf_cache.py repair [--verify]   # --verify also re-checks checksums
+#   python pdf_cache.py evict
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+CACHE_DIR = "uspto_pdf_cache"
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+STATE_DIR = "uspto_state"
+os.makedirs(STATE_DIR, exist_ok=True)
+DB_PATH = os.path.join(STATE_DIR, "pdf_cache.db")
+
+# Disk budget for cached PDFs
+MAX_BYTES = int(os.environ.get("PDF_CACHE_MAX_BYTES", 5 * 1024 * 1024 * 1024))
+
+# Eviction order: kinds listed first go first
+EVICTION_ORDER = ["raw", "ptab_doc", "ocr"]
+
+# Files used this recently are never evicted (they may be mid-OCR or mid-download)
+EVICT_GRACE = 15 * 60
+
+# last_access is only rewritten when it's older than this, to keep lookups read-only
+TOUCH_INTERVAL = 60
+
+# Temp files older than this belong to a writer that died
+TMP_MAX_AGE = 3600
+
+# Logs with no PDF left are deleted after this long
+LOG_RETENTION = 7 * 24 * 3600
+
+TMP_PREFIX = ".tmp-"
+
+_local = threading.local()
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                name TEXT PRIMARY KEY,
+                kind TEXT,
+                size INTEGER,
+                sha256 TEXT,
+                source TEXT,
+                created REAL,
+                last_access REAL,
+                filename TEXT,
+                content_type TEXT
+            )
+        """)
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(entries)")]
+        for column in ("filename", "content_type"):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE entries ADD COLUMN {column} TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+        _local.conn = conn
+    return conn
+
+
+def raw_name(patent_number):
+    return f"{patent_number}_raw.pdf"
+
+
+def ocr_name(patent_number):
+    return f"{patent_number}.pdf"
+
+
+def ptab_doc_name(document_identifier, pdf=True):
+    return f"ptab_{document_identifier}" + (".pdf" if pdf else "")
+
+
+def _kind_for_name(name):
+    if name.startswith("ptab_"):
+        return "ptab_doc"
+    return "raw" if name.endswith("_raw.pdf") else "ocr"
+
+
+def path(name):
+    return os.path.abspath(os.path.join(CACHE_DIR, name))
+
+
+# A fresh temp path in the cache directory for writing name; hand it to commit() when done
+def temp_path(name):
+    return path(f"{TMP_PREFIX}{uuid.uuid4().hex[:8]}-{name}")
+
+
+def _sha256(file_path):
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# Cheap completeness check: PDF header at the start, %%EOF near the end
+def looks_complete(file_path):
+    try:
+        size = os.path.getsize(file_path)
+        if size < 16:
+            return False
+        with open(file_path, "rb") as f:
+            head = f.read(8)
+            f.seek(max(0, size - 2048))
+            tail = f.read()
+        return head.startswith(b"%PDF-") and b"%%EOF" in tail
+    except OSError:
+        return False
+
+
+def get(name):
+    row = _connect().execute("SELECT * FROM entries WHERE name = ?", (name,)).fetchone()
+    return dict(row) if row else None
+
+
+def lookup(name, touch=True):
+    """
+    Returns the absolute path of a complete cached file, or None.
+    touch=False doesn't count as a use (for status checks).
+    """
+    entry = get(name)
+    file_path = path(name)
+    try:
+        if entry and os.path.getsize(file_path) != entry["size"]:
+            raise OSError("size changed")
+    except OSError:
+        print(f"⚠️ PDF cache entry {name} is missing or changed; dropping it")
+        _connect().execute("DELETE FROM entries WHERE name = ?", (name,))
+        entry = None
+    if touch:
+        with _stats_lock:
+            _stats["hits" if entry else "misses"] += 1
+    if not entry:
+        return None
+    now = time.time()
+    if touch and now - entry["last_access"] > TOUCH_INTERVAL:
+        try:
+            _connect().execute("UPDATE entries SET last_access = ? WHERE name = ?", (now, name))
+        except sqlite3.OperationalError:
+            pass  # Busy; a stale LRU timestamp is harmless
+    return file_path
+
+
+def commit(tmp_path, name, kind, source=None, filename=None, content_type=None):
+    """
+    Moves a finished temp file into the cache as name and indexes it. Returns its path.
+    filename / content_type are what to serve it as, if not a PDF named after the entry.
+    """
+    size = os.path.getsize(tmp_path)
+    digest = _sha256(tmp_path)
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    final = path(name)
+    os.replace(tmp_path, final)
+    now = time.time()
+    _connect().execute(
+        "INSERT OR REPLACE INTO entries"
+        " (name, kind, size, sha256, source, created, last_access, filename, content_type)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (name, kind, size, digest, source, now, now, filename, content_type),
+    )
+    evict()
+    return final
+
+
+def put_bytes(name, kind, data, source=None):
+    tmp = temp_path(name)
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        return commit(tmp, name, kind, source)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def remove(name):
+    _connect().execute("DELETE FROM entries WHERE name = ?", (name,))
+    try:
+        os.remove(path(name))
+    except FileNotFoundError:
+        pass
+
+
+# Hits and misses of lookups that counted as a use (touch=True)
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def total_bytes():
+    return _connect().execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+
+# Drops LRU raw copies, then LRU OCR'd ones, until the cache fits in max_bytes
+def evict(max_bytes=None):
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    total = total_bytes()
+    if total <= max_bytes:
+        return 0
+
+    order = " ".join(f"WHEN '{kind}' THEN {i}" for i, kind in enumerate(EVICTION_ORDER))
+    rows = _connect().execute(
+        f"SELECT name, size FROM entries WHERE last_access < ?"
+        f" ORDER BY CASE kind {order} ELSE {len(EVICTION_ORDER)} END, last_access",
+        (time.time() - EVICT_GRACE,),
+    ).fetchall()
+    dropped = 0
+    for row in rows:
+        if total <= max_bytes:
+            break
+        remove(row["name"])
+        total -= row["size"]
+        dropped += 1
+    print(f"🧹 PDF cache evicted {dropped} files, {total / 1e6:.0f} MB left")
+    return dropped
+
+
+def repair(verify=False):
+    """
+    Brings the index and the cache directory back in line (see top of file).
+    verify=True also re-hashes every indexed file. Returns counts of what it did.
+    """
+    conn = _connect()
+    counts = {"temp_removed": 0, "forgotten": 0, "adopted": 0, "purged": 0, "logs_removed": 0}
+    now = time.time()
+    indexed = {row["name"]: dict(row) for row in conn.execute("SELECT * FROM entries")}
+    files = set(os.listdir(CACHE_DIR))
+
+    for name in files:
+        file_path = path(name)
+        if name.startswith(TMP_PREFIX):
+            # Temp files, and work directories named after them (e.g. split OCR chunks)
+            if now - os.path.getmtime(file_path) > TMP_MAX_AGE:
+                if os.path.isdir(file_path):
+                    shutil.rmtree(file_path, ignore_errors=True)
+                else:
+                    os.remove(file_path)
+                counts["temp_removed"] += 1
+            continue
+
+        if name.endswith(".log"):
+            patent_number = name[:-len(".log")]
+            has_pdf = raw_name(patent_number) in files or ocr_name(patent_number) in files
+            if not has_pdf and now - os.path.getmtime(file_path) > LOG_RETENTION:
+                os.remove(file_path)
+                counts["logs_removed"] += 1
+            continue
+
+        if not name.endswith(".pdf"):
+            continue
+
+        entry = indexed.get(name)
+        bad = not looks_complete(file_path)
+        if entry and not bad:
+            bad = os.path.getsize(file_path) != entry["size"] or (verify and _sha256(file_path) != entry["sha256"])
+        if bad:
+            print(f"🗑️ PDF cache: purging corrupt {name}")
+            remove(name)
+            counts["purged"] += 1
+        elif not entry:
+            kind = _kind_for_name(name)
+            mtime = os.path.getmtime(file_path)
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (name, kind, size, sha256, source, created, last_access)"
+                " VALUES (?, ?, ?, ?, 'adopted', ?, ?)",
+                (name, kind, os.path.getsize(file_path), _sha256(file_path), mtime, mtime),
+            )
+            counts["adopted"] += 1
+
+    for name in indexed:
+        if name not in files:
+            conn.execute("DELETE FROM entries WHERE name = ?", (name,))
+            counts["forgotten"] += 1
+
+    print(f"🩺 PDF cache repair: {counts}")
+    evict()
+    return counts
+
+
+# Runs repair() once on a daemon thread, so start-up doesn't wait on hashing
+def start_repair():
+    def run():
+        try:
+            repair()
+        except Exception as e:
+            print(f"❌ PDF cache repair failed: {e}")
+
+    thread = threading.Thread(target=run, name="pdf-cache-repair", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("repair", "evict"):
+        print("usage: python pdf_cache.py repair [--verify] | evict")
+        sys.exit(1)
+    if sys.argv[1] == "repair":
+        repair(verify="--verify" in sys.argv)
+    else:
+        evict()
@@ -0,0 +1,362 @@
+# pdf_jobs.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Queue for the slow PDF work: downloading a patent's raw PDF and OCRing it.
+#
+# There is at most one job per patent + stage; asking again while one is queued
+# or running just returns it, so double-clicks and concurrent users share the work.
+# Job state lives in SQLite, shared by every WSGI worker and kept across restarts.
+# Each stage has a fixed number of job slots across all processes. A running job
+# holds a lease that its worker keeps renewing; if the process dies the lease runs
+# out and another worker runs the job again.
+#
+# Interactive jobs (someone is waiting on the progress page) run ahead of batch
+# jobs such as prefetches. To queue batch downloads from the command line:
+#   python pdf_jobs.py prefetch 10123456 10234567 ...
+
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import metrics
+import ocr_pool
+
+STATE_DIR = "uspto_state"
+os.makedirs(STATE_DIR, exist_ok=True)
+DB_PATH = os.path.join(STATE_DIR, "pdf_jobs.db")
+
+# Jobs of each stage allowed to run at once, across all processes
+WORKERS = {
+    "download": 2,  # Each one drives a headless browser
+    "ocr": ocr_pool.SLOTS,  # Each run gets its own share of the cores
+}
+
+# Job priorities; lower runs first
+INTERACTIVE = 0
+BATCH = 1
+
+# Rough run time of a stage, until there are finished jobs to average
+DEFAULT_DURATION = {
+    "download": 20,
+    "ocr": 180,
+}
+
+# Finished jobs averaged for run time estimates
+DURATION_SAMPLE = 20
+
+# Most jobs allowed to wait in the queue at once
+MAX_QUEUED = 50
+
+# A running job's lease; its worker renews it every LEASE / 3 seconds
+LEASE = 60
+
+# A job whose worker died this many times in a row is marked failed
+MAX_ATTEMPTS = 3
+
+# Idle workers check for new jobs this often
+POLL_INTERVAL = 1
+
+# Finished and failed jobs are forgotten after this long
+RETENTION = 7 * 24 * 3600
+
+JOB_SECONDS = metrics.Histogram(
+    "pdf_job_seconds", "Run time of PDF jobs in this process", ["stage", "outcome"], buckets=metrics.JOB_BUCKETS
+)
+
+_local = threading.local()
+_started = False
+_started_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                patent_number TEXT,
+                stage TEXT,
+                status TEXT,
+                priority INTEGER DEFAULT 0,
+                progress INTEGER DEFAULT 0,
+                detail TEXT,
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                created REAL,
+                started REAL,
+                updated REAL,
+                finished REAL,
+                lease_until REAL DEFAULT 0
+            )
+        """)
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(jobs)")]
+        if "priority" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER DEFAULT 0")
+        if "detail" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN detail TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_patent ON jobs (patent_number)")
+        _local.conn = conn
+    return conn
+
+
+def job_id(patent_number, stage):
+    return f"{stage}:{patent_number}"
+
+
+def get(patent_number, stage):
+    row = _connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id(patent_number, stage),)).fetchone()
+    return dict(row) if row else None
+
+
+# Most recently created job for the patent, whatever its stage
+def latest(patent_number):
+    row = _connect().execute(
+        "SELECT * FROM jobs WHERE patent_number = ? ORDER BY created DESC LIMIT 1", (patent_number,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def enqueue(patent_number, stage, priority=INTERACTIVE):
+    """
+    Queues stage for patent_number and returns its job, or returns the job already
+    queued or running (moving a queued one up if this request has higher priority).
+    A done or failed job is queued again (e.g. after its output was deleted).
+    Raises QueueFull if MAX_QUEUED jobs are already waiting.
+    """
+    if stage not in WORKERS:
+        raise ValueError(f"Unknown PDF job stage: {stage}")
+    conn = _connect()
+    jid = job_id(patent_number, stage)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT status, priority FROM jobs WHERE id = ?", (jid,)).fetchone()
+        if row and row["status"] in ("queued", "running"):
+            if priority < row["priority"]:
+                conn.execute("UPDATE jobs SET priority = ? WHERE id = ?", (priority, jid))
+            conn.execute("COMMIT")
+            return get(patent_number, stage)
+        queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        if queued >= MAX_QUEUED:
+            conn.execute("ROLLBACK")
+            raise QueueFull(f"{queued} PDF jobs are already waiting; try again in a few minutes")
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (id, patent_number, stage, status, priority, created, updated)"
+            " VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+            (jid, patent_number, stage, priority, now, now),
+        )
+        conn.execute("COMMIT")
+    except QueueFull:
+        raise
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    print(f"📋 Queued {stage} job for {patent_number}")
+    return get(patent_number, stage)
+
+
+# Number of jobs by (stage, status), across all processes
+def counts():
+    rows = _connect().execute("SELECT stage, status, COUNT(*) FROM jobs GROUP BY stage, status").fetchall()
+    return {(row[0], row[1]): row[2] for row in rows}
+
+
+# Position of a queued job among queued jobs of its stage (1 = next up), 0 if not queued
+def queue_position(job):
+    if not job or job["status"] != "queued":
+        return 0
+    return _connect().execute(
+        "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND stage = ?"
+        " AND (priority < ? OR (priority = ? AND created <= ?))",
+        (job["stage"], job["priority"], job["priority"], job["created"]),
+    ).fetchone()[0]
+
+
+# Average run time of recent finished jobs of stage, in seconds
+def typical_duration(stage):
+    rows = _connect().execute(
+        "SELECT finished - started FROM jobs WHERE stage = ? AND status = 'done' AND started IS NOT NULL"
+        " ORDER BY finished DESC LIMIT ?",
+        (stage, DURATION_SAMPLE),
+    ).fetchall()
+    if not rows:
+        return DEFAULT_DURATION[stage]
+    return sum(row[0] for row in rows) / len(rows)
+
+
+def eta(job):
+    """
+    Rough seconds until job finishes, or None if it isn't queued or running.
+    A queued job waits for the jobs ahead of it (and those running) to clear its
+    stage's slots, then takes a typical run time itself.
+    """
+    if not job or job["status"] not in ("queued", "running"):
+        return None
+    duration = typical_duration(job["stage"])
+    now = time.time()
+    if job["status"] == "running":
+        elapsed = now - (job["started"] or now)
+        if job["progress"]:
+            duration = elapsed * 100 / job["progress"]
+        return max(duration - elapsed, 0)
+
+    running = _connect().execute(
+        "SELECT COUNT(*) FROM jobs WHERE stage = ? AND status = 'running' AND lease_until >= ?",
+        (job["stage"], now),
+    ).fetchone()[0]
+    ahead = queue_position(job) - 1 + running
+    return (math.ceil((ahead + 1) / WORKERS[job["stage"]])) * duration
+
+
+# Records how far a running job has got; detail is a short note like "OCR page 40 of 120"
+def set_progress(patent_number, stage, progress, detail=None):
+    _connect().execute(
+        "UPDATE jobs SET progress = ?, detail = ?, updated = ? WHERE id = ?",
+        (int(progress), detail, time.time(), job_id(patent_number, stage)),
+    )
+
+
+# Claims the oldest runnable job of stage, if the stage has a free slot
+def _claim(stage):
+    conn = _connect()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        running = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE stage = ? AND status = 'running' AND lease_until >= ?",
+            (stage, now),
+        ).fetchone()[0]
+        row = None
+        if running < WORKERS[stage]:
+            # Queued jobs, plus running ones whose worker died
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE stage = ? AND (status = 'queued'"
+                " OR (status = 'running' AND lease_until < ?)) ORDER BY priority, created LIMIT 1",
+                (stage, now),
+            ).fetchone()
+        if row and row["status"] == "running" and row["attempts"] >= MAX_ATTEMPTS:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished = ?, updated = ?, lease_until = 0 WHERE id = ?",
+                ("Worker stopped while running this job too many times", now, now, row["id"]),
+            )
+            row = None
+        elif row:
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, progress = 0, detail = NULL,"
+                " started = ?, updated = ?, lease_until = ? WHERE id = ?",
+                (now, now, now + LEASE, row["id"]),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if not row:
+        return None
+    return dict(row, status="running", attempts=row["attempts"] + 1, started=now)
+
+
+def _renew_lease(job, stop):
+    while not stop.wait(LEASE / 3):
+        try:
+            _connect().execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'",
+                (time.time() + LEASE, job["id"]),
+            )
+        except sqlite3.Error as e:
+            print(f"⚠️ Could not renew lease on {job['id']}: {e}")
+
+
+def _finish(job, error=None):
+    now = time.time()
+    _connect().execute(
+        "UPDATE jobs SET status = ?, progress = ?, error = ?, finished = ?, updated = ?, lease_until = 0 WHERE id = ?",
+        ("failed" if error else "done", 0 if error else 100, str(error) if error else None, now, now, job["id"]),
+    )
+    JOB_SECONDS.observe(now - job["started"], stage=job["stage"], outcome="failed" if error else "done")
+    if error:
+        print(f"❌ {job['stage']} job for {job['patent_number']} failed: {error}")
+    else:
+        print(f"✅ {job['stage']} job for {job['patent_number']} done in {now - job['started']:.0f}s")
+
+
+def _run(job, handler):
+    stop = threading.Event()
+    renewer = threading.Thread(target=_renew_lease, args=(job, stop), daemon=True)
+    renewer.start()
+    try:
+        handler(job["patent_number"])
+        _finish(job)
+    except Exception as e:
+        _finish(job, e)
+    finally:
+        stop.set()
+
+
+def _purge_old():
+    _connect().execute(
+        "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (time.time() - RETENTION,)
+    )
+
+
+def start_workers(handlers):
+    """
+    Starts this process's PDF workers (once): WORKERS[stage] threads per stage.
+    handlers maps stage -> fn(patent_number), which raises if the job failed.
+    """
+    global _started
+    with _started_lock:
+        if _started:
+            return
+        _started = True
+
+    def loop(stage, handler):
+        while True:
+            try:
+                job = _claim(stage)
+                if not job:
+                    time.sleep(POLL_INTERVAL)
+                    continue
+                _run(job, handler)
+            except Exception as e:
+                print(f"❌ PDF {stage} worker error: {e}")
+                time.sleep(POLL_INTERVAL)
+
+    for stage, handler in handlers.items():
+        for i in range(WORKERS[stage]):
+            threading.Thread(target=loop, args=(stage, handler), name=f"pdf-{stage}-{i}", daemon=True).start()
+
+    try:
+        _purge_old()
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not purge old PDF jobs: {e}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "prefetch":
+        print("usage: python pdf_jobs.py prefetch PATENT_NUMBER ...")
+        sys.exit(1)
+    for number in sys.argv[2:]:
+        enqueue(number, "download", priority=BATCH)
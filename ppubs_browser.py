@@ -0,0 +1,252 @@
+# ppubs_browser.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Finds a patent's downloadPdf link on ppubs with a pool of warm headless browsers.
+#
+# Playwright's sync API only works from the thread that started it, so each pool
+# slot is a thread that owns one Chromium and runs lookups from a shared queue in
+# a fresh context, one page at a time. A slot relaunches its browser when it
+# disconnects, after MAX_USES lookups, or when Chromium grows past MAX_BROWSER_RSS.
+#
+# Resolved URLs are remembered (per patent, and as a pattern per kind of patent
+# number), so repeat lookups and patents whose URL can be predicted from the
+# pattern skip the browser. Callers must report a predicted URL that didn't work
+# with forget() and resolve again with use_cache=False.
+#
+# To try it against a local stand-in page instead of ppubs:
+#   PPUBS_SEARCH_URL=file://$PWD/dev/ppubs_standin.html python ppubs_browser.py 10123456
+
+import os
+import queue
+import re
+import sys
+import threading
+from concurrent.futures import Future
+
+from playwright.sync_api import Error as PlaywrightError, TimeoutError as PlaywrightTimeout, sync_playwright
+
+import metrics
+import response_cache
+
+PPUBS_SEARCH_URL = os.environ.get(
+    "PPUBS_SEARCH_URL", "https://ppubs.uspto.gov/pubwebapp/static/pages/ppubsbasic.html"
+)
+
+# Browsers (and so pages) open at once in this process
+POOL_SIZE = 2
+
+# A browser is relaunched after this many lookups
+MAX_USES = 50
+
+# ...or once all of this process's Chromium processes together use more than this
+MAX_BROWSER_RSS = 1024 * 1024 * 1024
+
+# Process names (/proc/<pid>/comm, cut to 15 characters) of Playwright's Chromium builds
+BROWSER_PROCESS_NAME = re.compile(r"chrom|headless_shell")
+
+# Milliseconds to wait for the downloadPdf link to show up
+LOOKUP_TIMEOUT = 10000
+
+# Seconds a caller waits for a lookup, queueing included
+RESOLVE_TIMEOUT = 120
+
+# How long resolved URLs and URL patterns are trusted
+URL_TTL = response_cache.TTLS["ppubs_pdf_url"]
+
+URL_LOOKUPS = metrics.Counter(
+    "ppubs_pdf_url_lookups_total", "ppubs PDF URL lookups by where the answer came from", ["source"]
+)
+
+_requests = queue.Queue()
+_slots = []
+_slots_lock = threading.Lock()
+
+
+# Kind of patent number, e.g. "8" for an 8-digit utility patent, "D7", "RE5", "PP5"
+def _kind(patent_number):
+    m = re.fullmatch(r"([A-Z]*)(\d+)", str(patent_number).upper())
+    return f"{m.group(1)}{len(m.group(2))}" if m else None
+
+
+def _url_key(patent_number):
+    return response_cache.make_key("ppubs_pdf_url", PPUBS_SEARCH_URL, str(patent_number).upper())
+
+
+def _pattern_key(kind):
+    return response_cache.make_key("ppubs_pdf_url", PPUBS_SEARCH_URL, None, number_kind=kind)
+
+
+def remember(patent_number, pdf_url):
+    """
+    Records a downloadPdf URL that worked, and the pattern it implies for its kind of patent.
+    """
+    number = str(patent_number).upper()
+    response_cache.put(_url_key(number), "ppubs_pdf_url", pdf_url, URL_TTL)
+    kind = _kind(number)
+    if kind and pdf_url.count(number) == 1:
+        response_cache.put(_pattern_key(kind), "ppubs_pdf_url", pdf_url.replace(number, "{number}"), URL_TTL)
+
+
+# Drops what we know about the patent's URL and its pattern (e.g. the pattern stopped working)
+def forget(patent_number):
+    number = str(patent_number).upper()
+    response_cache.put(_url_key(number), "ppubs_pdf_url", None, 0)
+    kind = _kind(number)
+    if kind:
+        response_cache.put(_pattern_key(kind), "ppubs_pdf_url", None, 0)
+
+
+def resolve_pdf_url(patent_number, use_cache=True):
+    """
+    Returns (pdf_url, source) where source is "cache", "pattern" or "browser".
+    Raises if ppubs has no downloadPdf link for the patent.
+    """
+    number = str(patent_number).upper()
+    if use_cache:
+        found, url = response_cache.get(_url_key(number))
+        if found and url:
+            URL_LOOKUPS.inc(source="cache")
+            return url, "cache"
+        kind = _kind(number)
+        if kind:
+            found, pattern = response_cache.get(_pattern_key(kind))
+            if found and pattern:
+                URL_LOOKUPS.inc(source="pattern")
+                return pattern.replace("{number}", number), "pattern"
+
+    future = Future()
+    _ensure_slots()
+    _requests.put((number, future))
+    URL_LOOKUPS.inc(source="browser")
+    return future.result(timeout=RESOLVE_TIMEOUT), "browser"
+
+
+# Total resident memory of the Chromium process trees started by this process (Linux only).
+# Only the browsers' own trees count; other children, such as OCR subprocesses, don't
+def _browser_rss():
+    try:
+        children = {}
+        names = {}
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+                with open(f"/proc/{pid}/comm") as f:
+                    names[int(pid)] = f.read().strip()
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(pid))
+    except OSError:
+        return None
+
+    total = 0
+    todo = [(pid, False) for pid in children.get(os.getpid(), [])]
+    while todo:
+        pid, in_browser = todo.pop()
+        # Below the Playwright driver, a browser's tree starts at its first Chromium process
+        in_browser = in_browser or bool(BROWSER_PROCESS_NAME.search(names.get(pid, "")))
+        todo.extend((child, in_browser) for child in children.get(pid, []))
+        if not in_browser:
+            continue
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+class _Slot(threading.Thread):
+    def __init__(self, index):
+        super().__init__(name=f"ppubs-browser-{index}", daemon=True)
+        self.browser = None
+        self.uses = 0
+
+    def _healthy(self):
+        if self.browser is None or not self.browser.is_connected():
+            return False
+        if self.uses >= MAX_USES:
+            return False
+        rss = _browser_rss()
+        return rss is None or rss <= MAX_BROWSER_RSS
+
+    def _close(self):
+        if self.browser is not None:
+            try:
+                self.browser.close()
+            except PlaywrightError:
+                pass
+        self.browser = None
+
+    def _lookup(self, chromium, patent_number):
+        if not self._healthy():
+            if self.browser is not None:
+                print(f"♻️ Recycling ppubs browser after {self.uses} lookups")
+            self._close()
+            self.browser = chromium.launch(headless=True)
+            self.uses = 0
+        self.uses += 1
+
+        context = self.browser.new_context()
+        try:
+            page = context.new_page()
+            page.goto(PPUBS_SEARCH_URL)
+            page.fill("#quickLookupTextInput", patent_number)
+            page.keyboard.press("Enter")
+            page.wait_for_selector("a[href*='downloadPdf']", timeout=LOOKUP_TIMEOUT)
+            hrefs = page.locator("a[href*='downloadPdf']").evaluate_all("els => els.map(e => e.href)")
+        finally:
+            context.close()
+
+        pdf_url = next((url for url in hrefs if patent_number in url.upper()), None)
+        if not pdf_url:
+            raise Exception(f"No PDF URL found for {patent_number}")
+        return pdf_url
+
+    def run(self):
+        with sync_playwright() as p:
+            while True:
+                patent_number, future = _requests.get()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(self._lookup(p.chromium, patent_number))
+                except PlaywrightTimeout as e:
+                    future.set_exception(Exception(f"No PDF link for {patent_number} on ppubs: {e}"))
+                except PlaywrightError as e:
+                    # Anything but a timeout may mean a broken browser; start a fresh one next time
+                    self._close()
+                    future.set_exception(e)
+                except Exception as e:
+                    future.set_exception(e)
+
+
+def _ensure_slots():
+    with _slots_lock:
+        _slots[:] = [slot for slot in _slots if slot.is_alive()]
+        while len(_slots) < POOL_SIZE:
+            slot = _Slot(len(_slots))
+            slot.start()
+            _slots.append(slot)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python ppubs_browser.py PATENT_NUMBER [--no-cache]")
+        sys.exit(1)
+    print(resolve_pdf_url(sys.argv[1], use_cache="--no-cache" not in sys.argv))
@@ -0,0 +1,286 @@
+# ptab_documents.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Complete document lists of PTAB proceedings, stored per proceeding in SQLite.
+#
+# The first time a proceeding is asked for, every page of its documents is fetched
+# (the first page says how many there are; the rest are fetched concurrently). After
+# that a list older than REFRESH_INTERVAL is refreshed by fetching only documents
+# filed on or after the newest filing date already stored, and merging them in by
+# document identifier. If a refresh fails the stored list is used as it is.
+#
+# Filing dates are normalized to YYYY-MM-DD when stored, and document numbers to
+# integers, so lists come back already sorted by SQLite (newest first, then lowest
+# document number) with no per-row date parsing. The normalized date is only used for
+# sorting and refresh; lists show the filing date as the API gave it (MM-DD-YYYY).
+#
+#   python ptab_documents.py refresh IPR2020-00001 [--full]
+
+import contextvars
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from dateutil import parser as date_parser
+
+import ptab_index
+import response_cache
+import single_flight
+import uspto_client
+
+STATE_DIR = "uspto_state"
+os.makedirs(STATE_DIR, exist_ok=True)
+DB_PATH = os.path.join(STATE_DIR, "ptab_documents.db")
+
+DOCUMENTS_URL = "https://developer.uspto.gov/ptab-api/documents"
+
+# Records per page (the documents API's max)
+PAGE_SIZE = 500
+
+# Pages fetched at once after the first
+PAGE_WORKERS = 4
+
+# A stored list is refreshed when it's older than this
+REFRESH_INTERVAL = response_cache.TTLS["ptab_documents"]
+
+# Date formats the PTAB API has been seen to use; anything else goes through dateutil
+DATE_FORMATS = ["%m-%d-%Y", "%Y-%m-%d", "%m/%d/%Y", "%Y-%m-%dT%H:%M:%S", "%m-%d-%Y %H:%M"]
+
+_local = threading.local()
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                proceeding_number TEXT,
+                document_identifier TEXT,
+                document_number TEXT,
+                number_sort INTEGER,
+                document_type TEXT,
+                document_name TEXT,
+                filing_date TEXT,
+                api_filing_date TEXT,
+                PRIMARY KEY (proceeding_number, document_identifier)
+            )
+        """)
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(documents)")]
+        if "api_filing_date" not in columns:
+            conn.execute("ALTER TABLE documents ADD COLUMN api_filing_date TEXT")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS documents_order"
+            " ON documents (proceeding_number, filing_date DESC, number_sort)"
+        )
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS proceedings (
+                proceeding_number TEXT PRIMARY KEY,
+                refreshed REAL,
+                full_refreshed REAL
+            )
+        """)
+        _local.conn = conn
+    return conn
+
+
+# Filing date as YYYY-MM-DD, or "" if there isn't a readable one
+def normalize_date(value):
+    value = str(value or "").strip()
+    if not value:
+        return ""
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    try:
+        return date_parser.parse(value).strftime("%Y-%m-%d")
+    except (ValueError, OverflowError):
+        return ""
+
+
+def _number_sort(value):
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return -1
+
+
+def _to_row(proceeding_number, item):
+    identifier = item.get("documentIdentifier")
+    number = item.get("documentNumber")
+    return (
+        proceeding_number,
+        identifier or f"{proceeding_number}:{number}",  # Rows without one still need a key
+        number,
+        _number_sort(number),
+        item.get("documentTypeName"),
+        item.get("documentName"),
+        normalize_date(item.get("documentFilingDate")),
+        item.get("documentFilingDate"),
+    )
+
+
+def _fetch_page(proceeding_number, offset, since=None):
+    params = {
+        "proceedingNumber": proceeding_number,
+        "recordTotalQuantity": PAGE_SIZE,
+        "recordStartNumber": offset,
+    }
+    if since:
+        params["documentFilingFromDate"] = since
+    resp = uspto_client.get(DOCUMENTS_URL, params=params, headers={"accept": "application/json"})
+    resp.raise_for_status()
+    data = resp.json()
+    return data.get("results", []), data.get("recordTotalQuantity") or 0
+
+
+def fetch_all(proceeding_number, since=None):
+    """
+    Every document of the proceeding (filed on or after since, an API-format date),
+    in the PTAB API's own field names. Pages after the first are fetched concurrently.
+    """
+    results, total = _fetch_page(proceeding_number, 0, since)
+    if len(results) < PAGE_SIZE or not total or total <= len(results):
+        return results
+
+    offsets = range(len(results), total, PAGE_SIZE)
+    ctx = contextvars.copy_context()  # So page fetches count towards the caller's request timings
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as pool:
+        pages = list(pool.map(
+            lambda offset: ctx.copy().run(_fetch_page, proceeding_number, offset, since)[0], offsets
+        ))
+    for page in pages:
+        results.extend(page)
+    print(f"📄 PTAB documents for {proceeding_number}: {len(results)} of {total} in {len(offsets) + 1} pages")
+    return results
+
+
+def refresh(proceeding_number, full=False):
+    """
+    Brings the stored list up to date: everything if full or nothing is stored yet,
+    otherwise documents filed since the newest stored one. Returns documents written.
+    """
+    conn = _connect()
+    newest = None
+    if not full:
+        row = conn.execute(
+            "SELECT MAX(filing_date) FROM documents WHERE proceeding_number = ? AND filing_date != ''",
+            (proceeding_number,),
+        ).fetchone()
+        newest = row[0] if row else None
+    known = conn.execute(
+        "SELECT 1 FROM proceedings WHERE proceeding_number = ?", (proceeding_number,)
+    ).fetchone()
+    incremental = bool(known and newest)
+
+    # The newest day is fetched again, in case more was filed that day after the last refresh
+    since = datetime.strptime(newest, "%Y-%m-%d").strftime(ptab_index.API_DATE_FORMAT) if incremental else None
+    items = fetch_all(proceeding_number, since)
+
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if not incremental:
+            conn.execute("DELETE FROM documents WHERE proceeding_number = ?", (proceeding_number,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO documents (proceeding_number, document_identifier, document_number,"
+            " number_sort, document_type, document_name, filing_date, api_filing_date)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [_to_row(proceeding_number, item) for item in items],
+        )
+        conn.execute(
+            "INSERT INTO proceedings (proceeding_number, refreshed, full_refreshed) VALUES (?, ?, ?)"
+            " ON CONFLICT (proceeding_number) DO UPDATE SET refreshed = excluded.refreshed,"
+            " full_refreshed = COALESCE(excluded.full_refreshed, full_refreshed)",
+            (proceeding_number, now, None if incremental else now),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    print(f"🔄 PTAB documents for {proceeding_number}: {len(items)} {'new since ' + since if incremental else 'in total'}")
+    return len(items)
+
+
+# Filing date as shown in lists: the API's own text, or for rows stored before that was
+# kept, the normalized date back in the API's MM-DD-YYYY
+def _display_date(row):
+    if row["api_filing_date"]:
+        return row["api_filing_date"]
+    if row["filing_date"]:
+        return datetime.strptime(row["filing_date"], "%Y-%m-%d").strftime("%m-%d-%Y")
+    return "—"
+
+
+def stored(proceeding_number):
+    """
+    The stored documents of the proceeding, newest filing first, then lowest document number,
+    ready to display ("—" for missing fields). document_identifier is None if there isn't one.
+    """
+    rows = _connect().execute(
+        "SELECT document_identifier, document_number, document_type, document_name, filing_date, api_filing_date"
+        " FROM documents WHERE proceeding_number = ? ORDER BY filing_date DESC, number_sort",
+        (proceeding_number,),
+    ).fetchall()
+    return [
+        {
+            "filing_date": _display_date(row),
+            "document_type": row["document_type"] or "—",
+            "document_number": row["document_number"] or "—",
+            "document_identifier": None if row["document_identifier"].startswith(f"{proceeding_number}:") else row["document_identifier"],
+            "document_name": row["document_name"] or "—",
+        }
+        for row in rows
+    ]
+
+
+def get(proceeding_number, force_refresh=False):
+    """
+    The proceeding's documents (see stored()), refreshing them first if they're older
+    than REFRESH_INTERVAL or force_refresh. Raises only if nothing is stored and the
+    first fetch fails.
+    """
+    proceeding_number = proceeding_number.strip().upper()
+    if not re.fullmatch(r"[\w-]+", proceeding_number):
+        raise ValueError(f"Invalid proceeding number: {proceeding_number}")
+    row = _connect().execute(
+        "SELECT refreshed FROM proceedings WHERE proceeding_number = ?", (proceeding_number,)
+    ).fetchone()
+    if force_refresh or not row or time.time() - row["refreshed"] > REFRESH_INTERVAL:
+        try:
+            # Concurrent visits to the same proceeding share one refresh
+            single_flight.do(("ptab_documents", proceeding_number), lambda: refresh(proceeding_number))
+        except Exception as e:
+            if not row:
+                raise
+            print(f"⚠️ Could not refresh PTAB documents for {proceeding_number}, using stored list: {e}")
+    return stored(proceeding_number)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "refresh":
+        print("usage: python ptab_documents.py refresh PROCEEDING_NUMBER [--full]")
+        sys.exit(1)
+    refresh(sys.argv[2].upper(), full="--full" in sys.argv)
@@ -0,0 +1,300 @@
+# ptab_index.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Local SQLite index of every PTAB proceeding, so lookups by patent #, application #,
+# docket # or party name don't have to wait on developer.uspto.gov.
+#
+# The index is filled by one bulk sync that pages through the whole proceedings
+# API, then kept current by incremental syncs of proceedings modified since the
+# last run. Party names go into an FTS5 table for prefix matching.
+#
+# Sync from the command line (e.g. from cron):
+#   python ptab_index.py sync          # incremental, or full if the index is empty
+#   python ptab_index.py sync --full   # re-pull everything
+# or let the app run start_background_sync().
+
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import uspto_client
+
+STATE_DIR = "uspto_state"
+os.makedirs(STATE_DIR, exist_ok=True)
+DB_PATH = os.path.join(STATE_DIR, "ptab_index.db")
+
+PROCEEDINGS_URL = "https://developer.uspto.gov/ptab-api/proceedings"
+
+# Records per page during sync (the API's max)
+SYNC_PAGE_SIZE = 1000
+
+# Incremental syncs re-read this much before the last watermark, to cover
+# records modified while the previous sync was running
+SYNC_OVERLAP = timedelta(days=2)
+
+# A miss is trusted (no live API fallback) if the last sync finished this recently
+TRUST_MISSES_FOR = 6 * 3600
+
+# Only one process syncs at a time; the lease expires if that process dies
+SYNC_LEASE = 30 * 60
+
+# PTAB API date format for the ...FromDate query params
+API_DATE_FORMAT = "%m-%d-%Y"
+
+# The proceedings fields search_ptab_by_id maps, in the order stored here
+COLUMNS = [
+    ("proceedingNumber", "number"),
+    ("proceedingStatusCategory", "status"),
+    ("petitionerPartyName", "petitioner"),
+    ("proceedingFilingDate", "filing_date"),
+    ("respondentPatentNumber", "patent_number"),
+    ("respondentApplicationNumberText", "application_number"),
+    ("respondentPartyName", "patent_owner"),
+    ("proceedingLastModifiedDate", "last_modified"),
+]
+
+# search_ptab_by_id field -> index column for exact-match lookups
+EXACT_FIELDS = {
+    "proceedingNumber": "number",
+    "patentNumber": "patent_number",
+    "applicationNumberText": "application_number",
+}
+
+# search_ptab_by_id field -> FTS columns searched for party lookups
+PARTY_FIELDS = {
+    "patentOwnerName": ["patent_owner"],
+    "partyName": ["petitioner", "patent_owner"],
+}
+
+_local = threading.local()
+_has_fts = True
+
+
+def _connect():
+    global _has_fts
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS proceedings (
+                {", ".join(f"{col} TEXT" + (" PRIMARY KEY" if col == "number" else "") for _, col in COLUMNS)}
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS proceedings_patent ON proceedings (patent_number)")
+        conn.execute("CREATE INDEX IF NOT EXISTS proceedings_application ON proceedings (application_number)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        try:
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS parties_fts
+                USING fts5(number UNINDEXED, petitioner, patent_owner)
+            """)
+        except sqlite3.OperationalError:
+            print("⚠️ SQLite has no FTS5; party lookups will use LIKE")
+            _has_fts = False
+        _local.conn = conn
+    return conn
+
+
+def _get_meta(key, default=None):
+    row = _connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def _set_meta(key, value):
+    _connect().execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+def _row_to_record(row):
+    return {api: value for (api, _), value in zip(COLUMNS, row)}
+
+
+def is_populated():
+    return _get_meta("last_sync") is not None
+
+
+def is_fresh():
+    last_sync = _get_meta("last_sync")
+    return last_sync is not None and time.time() - float(last_sync) < TRUST_MISSES_FOR
+
+
+def lookup(field, value):
+    """
+    Returns proceedings records (in the PTAB API's own field names) where field matches value.
+    Exact match for patentNumber / applicationNumberText / proceedingNumber;
+    word-prefix match for patentOwnerName / partyName.
+    Returns None if the field isn't indexed or the index is empty.
+    """
+    if not is_populated():
+        return None
+    conn = _connect()
+    select = f"SELECT {', '.join(col for _, col in COLUMNS)} FROM proceedings"
+
+    if field in EXACT_FIELDS:
+        rows = conn.execute(f"{select} WHERE {EXACT_FIELDS[field]} = ? COLLATE NOCASE", (value,)).fetchall()
+        return [_row_to_record(r) for r in rows]
+
+    if field in PARTY_FIELDS:
+        words = re.findall(r"\w+", str(value).lower())
+        if not words:
+            return []
+        columns = PARTY_FIELDS[field]
+        if _has_fts:
+            terms = " AND ".join(f'"{w}"*' for w in words)
+            match = f"{{{' '.join(columns)}}} : ({terms})"
+            rows = conn.execute(
+                f"{select} WHERE rowid IN (SELECT rowid FROM parties_fts WHERE parties_fts MATCH ?)"
+                " ORDER BY filing_date DESC",
+                (match,),
+            ).fetchall()
+        else:
+            clauses = " OR ".join(
+                "(" + " AND ".join(f"{col} LIKE ?" for _ in words) + ")" for col in columns
+            )
+            params = [f"%{w}%" for _ in columns for w in words]
+            rows = conn.execute(f"{select} WHERE {clauses}", params).fetchall()
+        return [_row_to_record(r) for r in rows]
+
+    return None
+
+
+def upsert(records):
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for r in records:
+            values = [r.get(api) for api, _ in COLUMNS]
+            if not values[0]:
+                continue
+            # parties_fts rows share the proceedings rowid, so replacing one replaces both
+            old = conn.execute("SELECT rowid FROM proceedings WHERE number = ?", (values[0],)).fetchone()
+            if old and _has_fts:
+                conn.execute("DELETE FROM parties_fts WHERE rowid = ?", (old[0],))
+            cur = conn.execute(
+                f"INSERT OR REPLACE INTO proceedings VALUES ({', '.join('?' for _ in COLUMNS)})",
+                values,
+            )
+            if _has_fts:
+                conn.execute(
+                    "INSERT INTO parties_fts (rowid, number, petitioner, patent_owner) VALUES (?, ?, ?, ?)",
+                    (cur.lastrowid, values[0], r.get("petitionerPartyName") or "", r.get("respondentPartyName") or ""),
+                )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# Takes the sync lease; returns False if another process holds it
+def _take_lease():
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'sync_lease'").fetchone()
+        if row and float(row[0]) > time.time():
+            conn.execute("ROLLBACK")
+            return False
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('sync_lease', ?)",
+            (str(time.time() + SYNC_LEASE),),
+        )
+        conn.execute("COMMIT")
+        return True
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _release_lease():
+    _connect().execute("DELETE FROM meta WHERE key = 'sync_lease'")
+
+
+def sync(full=False):
+    """
+    Pulls proceedings into the index: everything if full (or the index is empty),
+    otherwise only those modified since the last sync. Returns records written,
+    or None if another process is already syncing.
+    """
+    if not _take_lease():
+        print("⏭️ PTAB index sync already running elsewhere")
+        return None
+
+    try:
+        started = time.time()
+        params = {"recordTotalQuantity": SYNC_PAGE_SIZE}
+        watermark = _get_meta("watermark")
+        if watermark and not full:
+            since = datetime.fromtimestamp(float(watermark)) - SYNC_OVERLAP
+            params["proceedingLastModifiedFromDate"] = since.strftime(API_DATE_FORMAT)
+            print(f"🔄 Incremental PTAB index sync since {params['proceedingLastModifiedFromDate']}")
+        else:
+            print("🔄 Full PTAB index sync")
+
+        written = 0
+        offset = 0
+        while True:
+            params["recordStartNumber"] = offset
+            resp = uspto_client.get(
+                PROCEEDINGS_URL, params=params, headers={"accept": "application/json"}, timeout=(5, 120)
+            )
+            resp.raise_for_status()
+            data = resp.json()
+            results = data.get("results", [])
+            if not results:
+                break
+            upsert(results)
+            written += len(results)
+            offset += len(results)
+            total = data.get("recordTotalQuantity") or 0
+            print(f"📚 PTAB index: {offset} of {total or '?'} proceedings")
+            if total and offset >= total:
+                break
+
+        _set_meta("watermark", started)
+        _set_meta("last_sync", time.time())
+        print(f"✅ PTAB index sync wrote {written} proceedings in {time.time() - started:.0f}s")
+        return written
+    finally:
+        _release_lease()
+
+
+def start_background_sync(interval):
+    """
+    Syncs the index every interval seconds on a daemon thread (full the first time).
+    Safe to call from every WSGI worker; only one of them syncs at a time.
+    """
+    def loop():
+        while True:
+            try:
+                sync()
+            except Exception as e:
+                print(f"❌ PTAB index sync failed: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="ptab-index-sync", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "sync":
+        print("usage: python ptab_index.py sync [--full]")
+        sys.exit(1)
+    sync(full="--full" in sys.argv)
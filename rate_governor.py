@@ -0,0 +1,268 @@
+# rate_governor.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Process-wide token buckets for the upstreams that share our USPTO API key.
+#
+# Bucket state lives in a small SQLite file, so every thread and every WSGI worker
+# process on the host draws from the same buckets. A 429 halves the bucket's
+# refill rate and pauses it for the Retry-After period; successful calls slowly
+# bring the rate back up to its configured ceiling.
+#
+# Work running with background set (e.g. bulk exports) only takes a token while the
+# bucket holds more than BACKGROUND_RESERVE of its burst, so interactive page loads
+# always have quota left over.
+
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+STATE_DIR = "uspto_state"
+os.makedirs(STATE_DIR, exist_ok=True)
+DB_PATH = os.path.join(STATE_DIR, "rate_governor.db")
+
+# name: (requests per second, burst size)
+BUCKETS = {
+    "search": (4.0, 8),
+    "continuity": (4.0, 8),
+    "ptab": (2.0, 4),
+}
+
+# Floor the adaptive rate never drops below, in requests per second
+MIN_RATE = 0.1
+
+# Multipliers applied to a bucket's rate on a 429 and on each successful call
+THROTTLE_FACTOR = 0.5
+RECOVER_FACTOR = 1.05
+
+# Longest single sleep while waiting, so waiters re-check state regularly
+MAX_SLEEP = 1.0
+
+# Share of each bucket's burst that background work must leave untouched
+BACKGROUND_RESERVE = 0.5
+
+# Set in threads doing bulk/background work so they yield quota to interactive requests
+background = contextvars.ContextVar("rate_governor_background", default=False)
+
+_local = threading.local()
+_waiting = {}
+_waiting_lock = threading.Lock()
+
+
+# Maps an upstream URL to its bucket name; None means the call isn't governed
+def upstream_for(url):
+    parts = urlsplit(url)
+    if parts.netloc == "api.uspto.gov":
+        return "continuity" if parts.path.endswith("/continuity") else "search"
+    if parts.netloc == "developer.uspto.gov" and parts.path.startswith("/ptab-api"):
+        return "ptab"
+    return None
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL,
+                updated REAL,
+                rate REAL,
+                paused_until REAL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS waiters (
+                name TEXT,
+                pid INTEGER,
+                count INTEGER,
+                PRIMARY KEY (name, pid)
+            )
+        """)
+        _local.conn = conn
+    return conn
+
+
+# Runs fn(conn) inside a write-locked transaction shared with other processes
+def _locked(fn):
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = fn(conn)
+        conn.execute("COMMIT")
+        return result
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# Runs fn(conn) in a read transaction: one consistent snapshot of every bucket, which in
+# WAL mode doesn't wait for (or hold up) a writer in _locked
+def _read(fn):
+    conn = _connect()
+    conn.execute("BEGIN")
+    try:
+        return fn(conn)
+    finally:
+        conn.execute("COMMIT")
+
+
+def _load(conn, name, now):
+    rate, burst = BUCKETS[name]
+    row = conn.execute(
+        "SELECT tokens, updated, rate, paused_until FROM buckets WHERE name = ?", (name,)
+    ).fetchone()
+    if row is None:
+        return float(burst), now, rate, 0.0
+    tokens, updated, current_rate, paused_until = row
+    tokens = min(float(burst), tokens + max(now - updated, 0) * current_rate)
+    return tokens, now, current_rate, paused_until
+
+
+def _save(conn, name, tokens, updated, rate, paused_until):
+    conn.execute(
+        "INSERT OR REPLACE INTO buckets (name, tokens, updated, rate, paused_until) VALUES (?, ?, ?, ?, ?)",
+        (name, tokens, updated, rate, paused_until),
+    )
+
+
+def _set_waiting(name, delta):
+    with _waiting_lock:
+        count = _waiting.get(name, 0) + delta
+        _waiting[name] = count
+    try:
+        _connect().execute(
+            "INSERT OR REPLACE INTO waiters (name, pid, count) VALUES (?, ?, ?)",
+            (name, os.getpid(), count),
+        )
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not record quota waiters: {e}")
+
+
+def acquire(name):
+    """
+    Blocks until the named bucket has a token, then takes it.
+    Returns the number of seconds spent waiting for quota.
+    """
+    if name not in BUCKETS:
+        return 0.0
+    needed = 1 + (BUCKETS[name][1] * BACKGROUND_RESERVE if background.get() else 0)
+
+    def try_take(conn):
+        now = time.time()
+        tokens, updated, rate, paused_until = _load(conn, name, now)
+        if now >= paused_until and tokens >= needed:
+            _save(conn, name, tokens - 1, updated, rate, paused_until)
+            return 0.0
+        _save(conn, name, tokens, updated, rate, paused_until)
+        return max(paused_until - now, (needed - tokens) / rate)
+
+    started = time.monotonic()
+    wait = _locked(try_take)
+    if not wait:
+        return 0.0
+
+    _set_waiting(name, 1)
+    try:
+        while wait:
+            time.sleep(min(wait, MAX_SLEEP))
+            wait = _locked(try_take)
+    finally:
+        _set_waiting(name, -1)
+    return time.monotonic() - started
+
+
+# Called on a 429: slow the bucket down and pause it for retry_after seconds
+def throttle(name, retry_after=1.0):
+    if name not in BUCKETS:
+        return
+
+    def update(conn):
+        now = time.time()
+        tokens, updated, rate, paused_until = _load(conn, name, now)
+        rate = max(MIN_RATE, rate * THROTTLE_FACTOR)
+        _save(conn, name, 0.0, updated, rate, max(paused_until, now + retry_after))
+        return rate
+
+    rate = _locked(update)
+    print(f"🐢 {name} quota throttled to {rate:.2f} req/s, paused {retry_after:.0f}s")
+
+
+# Called after a successful call: nudge a throttled bucket back toward its ceiling
+def recover(name):
+    if name not in BUCKETS:
+        return
+    ceiling = BUCKETS[name][0]
+
+    row = _connect().execute("SELECT rate FROM buckets WHERE name = ?", (name,)).fetchone()
+    if row is None or row[0] >= ceiling:
+        return  # Not throttled; skip the write lock
+
+    def update(conn):
+        now = time.time()
+        tokens, updated, rate, paused_until = _load(conn, name, now)
+        if rate < ceiling:
+            _save(conn, name, tokens, updated, min(ceiling, rate * RECOVER_FACTOR), paused_until)
+
+    _locked(update)
+
+
+# Number of calls currently waiting for quota, across all worker processes
+def queue_depth(name=None):
+    rows = _connect().execute("SELECT name, pid, count FROM waiters WHERE count > 0").fetchall()
+    depth = 0
+    for bucket, pid, count in rows:
+        if name and bucket != name:
+            continue
+        if pid != os.getpid() and not _pid_alive(pid):
+            continue  # Left behind by a worker that died while waiting
+        depth += count
+    return depth
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Snapshot of every bucket for status pages
+def status():
+    def read(conn):
+        now = time.time()
+        snapshot = {}
+        for name in BUCKETS:
+            tokens, _, rate, paused_until = _load(conn, name, now)
+            snapshot[name] = {
+                "tokens": round(tokens, 2),
+                "rate": round(rate, 3),
+                "paused_for": round(max(paused_until - now, 0), 1),
+                "waiting": 0,
+            }
+        return snapshot
+
+    snapshot = _read(read)
+    for name in snapshot:
+        snapshot[name]["waiting"] = queue_depth(name)
+    return snapshot
@@ -0,0 +1,213 @@
+# response_cache.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# On-disk TTL cache for upstream JSON answers (search pages, continuity bags,
+# PTAB proceedings). PTAB document lists are kept by ptab_documents instead.
+#
+# Entries are keyed by kind + normalized endpoint/query/fields and stored as
+# compressed JSON in SQLite, so the cache is shared by every WSGI worker and
+# survives restarts. Each kind has its own TTL, "nothing found" answers get a
+# short TTL of their own, and the file is held under MAX_BYTES by evicting the
+# least recently used entries.
+#
+# Lookups also go through single_flight: identical concurrent lookups share one
+# upstream call, and a repeat of the same lookup within one page render is
+# answered from the request memo without touching SQLite at all.
+
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import single_flight
+
+STATE_DIR = "uspto_state"
+os.makedirs(STATE_DIR, exist_ok=True)
+DB_PATH = os.path.join(STATE_DIR, "response_cache.db")
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Seconds each kind of answer stays fresh
+TTLS = {
+    "search": 12 * HOUR,        # Free-text search pages; new filings show up daily
+    "biblio": 7 * DAY,          # Exact-id lookups where every hit is already granted
+    "continuity": DAY,          # New continuations can be filed at any time
+    "ptab_proceedings": DAY,    # Proceedings change rarely
+    "ptab_documents": 6 * HOUR, # Active trials get new papers every few days
+    "ppubs_pdf_url": 30 * DAY,  # ppubs downloadPdf links and their patterns
+}
+
+# TTL for "no results" / 404 answers, whatever their kind
+NEGATIVE_TTL = 10 * 60
+
+# Disk budget for the cache; LRU entries are dropped past this
+MAX_BYTES = 200 * 1024 * 1024
+
+# How many writes between size checks
+EVICT_EVERY = 50
+
+# Set per request (e.g. from ?refresh=1) to skip cached answers and refetch
+bypass = contextvars.ContextVar("response_cache_bypass", default=False)
+
+_local = threading.local()
+_writes = 0
+_writes_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                kind TEXT,
+                value BLOB,
+                size INTEGER,
+                expires REAL,
+                last_access REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+        _local.conn = conn
+    return conn
+
+
+# Builds a stable key: whitespace in queries collapsed, field lists sorted
+def make_key(kind, endpoint, query=None, fields=None, **params):
+    if isinstance(query, str):
+        query = " ".join(query.split())
+    return json.dumps(
+        [kind, endpoint, query, sorted(fields) if fields else None, params],
+        sort_keys=True,
+    )
+
+
+def get(key):
+    """
+    Returns (found, value). Expired entries count as not found.
+    """
+    row = _connect().execute(
+        "SELECT value, expires FROM responses WHERE key = ?", (key,)
+    ).fetchone()
+    now = time.time()
+    if row is None or row[1] < now:
+        with _stats_lock:
+            _stats["misses"] += 1
+        return False, None
+    try:
+        _connect().execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+    except sqlite3.OperationalError:
+        pass  # Busy; a stale LRU timestamp is harmless
+    with _stats_lock:
+        _stats["hits"] += 1
+    return True, json.loads(zlib.decompress(row[0]))
+
+
+def put(key, kind, value, ttl):
+    global _writes
+    blob = zlib.compress(json.dumps(value).encode("utf-8"))
+    now = time.time()
+    _connect().execute(
+        "INSERT OR REPLACE INTO responses (key, kind, value, size, expires, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+        (key, kind, blob, len(blob), now + ttl, now),
+    )
+    with _writes_lock:
+        _writes += 1
+        check = _writes % EVICT_EVERY == 0
+    if check:
+        evict()
+
+
+def get_or_fetch(kind, key, fetch, is_empty=None, ttl=None):
+    """
+    Returns the cached answer for key, or calls fetch() and caches what it returns.
+    is_empty(value) marks "nothing found" answers, which get NEGATIVE_TTL.
+    ttl may be a number or a callable taking the value, to override the kind's TTL.
+    Exceptions from fetch() are not cached.
+    Every caller gets its own copy of the value, so it is safe to mutate.
+    """
+    flight_key = (key, bypass.get())
+    memo = single_flight.request_memo.get()
+    if memo is not None and flight_key in memo:
+        return json.loads(memo[flight_key])
+
+    text = single_flight.do(
+        flight_key,
+        lambda: json.dumps(_get_or_fetch(kind, key, fetch, is_empty, ttl)),
+    )
+    if memo is not None:
+        memo[flight_key] = text
+    return json.loads(text)
+
+
+def _get_or_fetch(kind, key, fetch, is_empty, ttl):
+    if not bypass.get():
+        found, value = get(key)
+        if found:
+            return value
+
+    value = fetch()
+    if is_empty and is_empty(value):
+        seconds = NEGATIVE_TTL
+    elif callable(ttl):
+        seconds = ttl(value)
+    else:
+        seconds = ttl if ttl is not None else TTLS[kind]
+    try:
+        put(key, kind, value, seconds)
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not cache {kind} response: {e}")
+    return value
+
+
+# Drops expired entries, then least recently used ones until under MAX_BYTES
+def evict(max_bytes=None):
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    conn = _connect()
+    conn.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total <= max_bytes:
+        return 0
+
+    dropped = 0
+    for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+        if total <= max_bytes:
+            break
+        conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        total -= size
+        dropped += 1
+    print(f"🧹 Response cache evicted {dropped} entries")
+    return dropped
+
+
+def invalidate(kind=None):
+    if kind:
+        _connect().execute("DELETE FROM responses WHERE kind = ?", (kind,))
+    else:
+        _connect().execute("DELETE FROM responses")
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,205 @@
+# result_cursors.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Short-lived server-side copies of search result tables.
+#
+# A search that produced a results table is kept here under a cursor id, so the
+# table can be paged, sorted and filtered through a JSON endpoint, and coming back
+# to the search re-renders it without asking USPTO again. Rows are stored as
+# zlib-compressed JSON arrays (one array per row, in COLUMNS order) in SQLite, so
+# every WSGI worker can page any cursor, and the store is capped by both entry
+# count and compressed bytes, oldest-used evicted first.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+STATE_DIR = "uspto_state"
+os.makedirs(STATE_DIR, exist_ok=True)
+DB_PATH = os.path.join(STATE_DIR, "result_cursors.db")
+
+COLUMNS = ["application_number", "patent_number", "filing_date", "status", "title", "assignees"]
+
+# Columns the results table may be sorted by
+SORTABLE = set(COLUMNS)
+
+# Sortable columns of numbers, sorted by value rather than as text
+NUMERIC_SORT = {"application_number", "patent_number"}
+
+# Cursors live this long after their last use
+TTL = 30 * 60
+
+# Caps on what the store holds
+MAX_CURSORS = 200
+MAX_BYTES = 256 * 1024 * 1024
+
+MAX_PER_PAGE = 500
+
+# last_used is only rewritten when it's older than this, to keep paging read-mostly
+TOUCH_INTERVAL = 60
+
+_local = threading.local()
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cursors (
+                id TEXT PRIMARY KEY,
+                search_term TEXT,
+                total INTEGER,
+                count INTEGER,
+                extras TEXT,
+                rows BLOB,
+                bytes INTEGER,
+                last_used REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS cursors_lru ON cursors (last_used)")
+        _local.conn = conn
+    return conn
+
+
+class _Cursor:
+    def __init__(self, search_term, total, count, extras, blob, last_used):
+        self.search_term = search_term
+        self.total = total
+        self.count = count
+        self.extras = extras
+        self.blob = blob
+        self.last_used = last_used
+
+    def rows(self):
+        return [dict(zip(COLUMNS, values)) for values in json.loads(zlib.decompress(self.blob))]
+
+
+# Same search with the same row cap always maps to the same cursor id
+def cursor_id_for(search_term, limit):
+    return hashlib.sha1(json.dumps([" ".join(search_term.split()).lower(), limit]).encode("utf-8")).hexdigest()[:16]
+
+
+def _evict():
+    conn = _connect()
+    conn.execute("DELETE FROM cursors WHERE last_used < ?", (time.time() - TTL,))
+    count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM cursors").fetchone()
+    if count <= MAX_CURSORS and total_bytes <= MAX_BYTES:
+        return
+    for row in conn.execute("SELECT id, bytes FROM cursors ORDER BY last_used").fetchall():
+        if count <= MAX_CURSORS and total_bytes <= MAX_BYTES:
+            break
+        conn.execute("DELETE FROM cursors WHERE id = ?", (row["id"],))
+        count -= 1
+        total_bytes -= row["bytes"]
+
+
+def put(cursor_id, search_term, rows, total, **extras):
+    """
+    Stores a results table. extras (e.g. proceedings) come back from get() as-is.
+    """
+    blob = zlib.compress(json.dumps([[row.get(col) for col in COLUMNS] for row in rows]).encode("utf-8"))
+    _connect().execute(
+        "INSERT OR REPLACE INTO cursors (id, search_term, total, count, extras, rows, bytes, last_used)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (cursor_id, search_term, total, len(rows), json.dumps(extras), blob, len(blob), time.time()),
+    )
+    _evict()
+    return cursor_id
+
+
+def get(cursor_id):
+    row = _connect().execute("SELECT * FROM cursors WHERE id = ?", (cursor_id,)).fetchone()
+    now = time.time()
+    if row is None or now - row["last_used"] > TTL:
+        with _stats_lock:
+            _stats["misses"] += 1
+        return None
+    with _stats_lock:
+        _stats["hits"] += 1
+    if now - row["last_used"] > TOUCH_INTERVAL:
+        try:
+            _connect().execute("UPDATE cursors SET last_used = ? WHERE id = ?", (now, cursor_id))
+        except sqlite3.OperationalError:
+            pass  # Busy; a stale LRU timestamp only makes eviction slightly less fair
+    return _Cursor(row["search_term"], row["total"], row["count"], json.loads(row["extras"]), row["rows"], now)
+
+
+def _matches(row, filters):
+    for col, value in filters.items():
+        if not value:
+            continue
+        if col == "filed_from":
+            if not row.get("filing_date") or row["filing_date"] < value:
+                return False
+        elif col == "filed_to":
+            if not row.get("filing_date") or row["filing_date"] > value:
+                return False
+        elif col == "q":
+            text = " ".join(str(v) for v in row.values() if v).lower()
+            if value.lower() not in text:
+                return False
+        elif value.lower() not in str(row.get(col) or "").lower():
+            return False
+    return True
+
+
+# Numbers (commas allowed) sort by value, ahead of anything else in the column (RE45123,
+# D912345, PCT/...), which sorts as text
+def _sort_key(column, value):
+    text = str(value).strip()
+    digits = text.replace(",", "")
+    if column in NUMERIC_SORT and digits.isdigit():
+        return (0, int(digits), "")
+    return (1, 0, text.lower())
+
+
+def page(cursor, page=1, per_page=100, sort=None, direction="asc", filters=None):
+    """
+    Returns (rows on this page, number of rows matching filters).
+    filters may hold status, assignees, title (substring matches), filed_from /
+    filed_to (YYYY-MM-DD bounds on filing_date) and q (matches any column).
+    """
+    rows = cursor.rows()
+    if filters:
+        rows = [row for row in rows if _matches(row, filters)]
+    if sort in SORTABLE:
+        present = [row for row in rows if row.get(sort)]
+        missing = [row for row in rows if not row.get(sort)]
+        present.sort(key=lambda row: _sort_key(sort, row[sort]), reverse=direction == "desc")
+        rows = present + missing  # Blanks always last
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    start = (max(page, 1) - 1) * per_page
+    return rows[start:start + per_page], len(rows)
+
+
+# Distinct values of a column, for filter dropdowns
+def distinct(cursor, column):
+    return sorted({row.get(column) for row in cursor.rows() if row.get(column)})
+
+
+def stats():
+    count, total_bytes = _connect().execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM cursors").fetchone()
+    with _stats_lock:
+        return {"cursors": count, "bytes": total_bytes, **_stats}
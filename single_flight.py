@@ -0,0 +1,78 @@
+# single_flight.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# De-duplication of identical upstream lookups.
+#
+# do(key, fn): when several threads ask for the same key at once, only the first
+# one runs fn; the rest wait for it and get the same result (or exception).
+#
+# request_memo: a dict scoped to one page render. start_request() installs a
+# fresh one; lookups that find their key there skip the upstream entirely.
+
+import contextvars
+import threading
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+request_memo = contextvars.ContextVar("request_memo", default=None)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+def do(key, fn):
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _inflight[key] = _Call()
+        else:
+            call.waiters += 1
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = fn()
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        if call.waiters:
+            print(f"🔗 Shared one upstream call with {call.waiters} waiting request(s)")
+        call.done.set()
+
+
+# Gives the current request (and threads running in a copy of its context) a fresh memo
+def start_request():
+    request_memo.set({})
+
+
+def in_flight():
+    with _inflight_lock:
+        return len(_inflight)
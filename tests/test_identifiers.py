@@ -0,0 +1,41 @@
+import pytest
+
+import identifiers
+
+
+@pytest.mark.parametrize("value, expected", [
+    # Application series 08/09 keep their leading zero
+    ("08123456", ("application", "08123456")),
+    ("US 08123456", ("application", "08123456")),
+    ("09123456", ("application", "09123456")),
+    ("08/123,456", ("application", "08123456")),
+    ("16/123,456", ("application", "16123456")),
+    ("90/012,345", ("application", "90012345")),
+    ("29123456", ("application", "29123456")),
+    # Zero-padded patent #s lose their zeros
+    ("06708213", ("patent", "6708213")),
+    ("6708213", ("patent", "6708213")),
+    ("US 6,708,213 B2", ("patent", "6708213")),
+    ("RE45,123", ("patent", "RE45123")),
+    ("D912,345", ("patent", "D912345")),
+    ("US 11,000,001 B2", ("patent", "11000001")),
+    ("11000001", ("patent_or_application", "11000001")),
+    ("123456", ("number", "123456")),
+    ("US 2019/0123456 A1", ("publication", "US20190123456A1")),
+    ("2019/0123456", ("publication", "US20190123456A1")),
+    ("WO 2019/123456", ("wo", "WO2019123456")),
+    ("PCT/US2019/012345", ("pct", "PCT/US2019/012345")),
+    ("pct/us19/1234", ("pct", "PCT/US19/01234")),
+    ("IPR2020-00001", ("docket", "IPR2020-00001")),
+    ("IPR 2020-00010", ("docket", "IPR2020-00010")),
+    ("ipr2014-342", ("docket", "IPR2014-00342")),
+    ("IPR2020-1234567", ("docket", "IPR2020-1234567")),
+    ("PGR2019-00012", ("docket", "PGR2019-00012")),
+])
+def test_normalize(value, expected):
+    assert identifiers.normalize(value) == expected
+
+
+@pytest.mark.parametrize("value", ["Apple Inc.", "1234", "", "  widget  ", "US 2019"])
+def test_normalize_free_text(value):
+    assert identifiers.normalize(value) == (None, value.strip())
@@ -0,0 +1,228 @@
+# uspto_client.py
+
+# # Copyright (c) 2025, Eliot D. Williams
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Shared HTTP client for every upstream call the app makes
+# (api.uspto.gov, developer.uspto.gov PTAB API, ppubs PDF downloads).
+#
+# - One connection pool per host, shared by all threads, so repeat calls reuse
+#   keep-alive connections instead of paying a fresh TCP+TLS handshake
+# - Each thread gets its own Session object on top of the shared pool, since
+#   Session cookie/header state isn't safe to mutate from several threads
+# - One retry/backoff policy for 429 and 5xx that honors Retry-After
+# - Every attempt against a USPTO API draws a token from rate_governor first
+# - Every attempt is counted and timed in metrics by call type, and the whole call
+#   (retries and quota waits included) is added to the request's Server-Timing
+
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import rate_governor
+
+# (connect, read) timeout used unless a caller passes its own
+DEFAULT_TIMEOUT = (5, 30)
+
+# Attempts per call, including the first one
+MAX_RETRIES = 4
+
+# Statuses that are worth retrying after a pause
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Connections kept alive per host; should cover the largest worker pool that
+# talks to one host at a time
+POOL_SIZE = 32
+
+# Longest we'll honor a server-sent Retry-After before giving up on waiting
+MAX_RETRY_AFTER = 120
+
+UPSTREAM_SECONDS = metrics.Histogram(
+    "upstream_request_seconds", "Latency of one upstream HTTP attempt (to response headers)", ["call"]
+)
+UPSTREAM_REQUESTS = metrics.Counter(
+    "upstream_requests_total", "Upstream HTTP attempts by response status ('error' if none)", ["call", "status"]
+)
+UPSTREAM_RETRIES = metrics.Counter(
+    "upstream_retries_total", "Upstream attempts that were retried, by what went wrong", ["call", "reason"]
+)
+UPSTREAM_RATE_LIMITED = metrics.Counter(
+    "upstream_rate_limited_total", "429 responses from upstream", ["call"]
+)
+QUOTA_WAIT_SECONDS = metrics.Histogram(
+    "upstream_quota_wait_seconds", "Time spent waiting on rate_governor for a token", ["call"]
+)
+
+_adapters = {}
+_adapters_lock = threading.Lock()
+_local = threading.local()
+
+
+# Pause shared by a group of related calls (e.g. one family walk): when any of
+# them is rate limited, all of them wait instead of each retrying blindly
+class SharedBackoff:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def wait(self):
+        with self._lock:
+            pause = self._resume_at - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+    def hit(self, delay):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+
+def _host(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _adapter_for(host):
+    with _adapters_lock:
+        adapter = _adapters.get(host)
+        if adapter is None:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, pool_block=True)
+            _adapters[host] = adapter
+        return adapter
+
+
+# Returns this thread's Session for the host of url, wired to the shared pool
+def get_session(url):
+    host = _host(url)
+    sessions = getattr(_local, "sessions", None)
+    if sessions is None:
+        sessions = _local.sessions = {}
+    session = sessions.get(host)
+    if session is None:
+        session = requests.Session()
+        session.headers["Accept-Encoding"] = "gzip, deflate"
+        session.mount(host, _adapter_for(host))
+        sessions[host] = session
+    return session
+
+
+# Kind of upstream call for metrics, and the Server-Timing stage it counts towards
+def call_type(url):
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    path = parts.path.rstrip("/")
+    if host.startswith("ppubs."):
+        return "ppubs_pdf", "ppubs"
+    if "/ptab-api/proceedings" in path:
+        return "ptab_proceedings", "ptab"
+    if "/ptab-api/documents" in path:
+        return ("ptab_document" if path.endswith("/download") else "ptab_documents"), "ptab"
+    if path.endswith("/continuity"):
+        return "continuity", "uspto"
+    if path.endswith("/applications/search"):
+        return "search_page", "uspto"
+    return "other", "upstream"
+
+
+# Seconds to wait according to a Retry-After header (delta-seconds or HTTP date)
+def retry_after_seconds(resp):
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except Exception:
+            return None
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+def request(method, url, timeout=DEFAULT_TIMEOUT, retries=MAX_RETRIES, backoff=None, **kwargs):
+    """
+    Sends one request through the shared pool.
+    429/5xx responses and connection errors are retried with exponential backoff
+    (or the server's Retry-After). The last response is returned as-is, so
+    callers still decide what 404 or a persistent 429 means for them.
+    Connection errors on the final attempt are raised.
+    """
+    call, stage = call_type(url)
+    with metrics.timed(stage):
+        return _request(method, url, call, timeout, retries, backoff, **kwargs)
+
+
+def _request(method, url, call, timeout, retries, backoff, **kwargs):
+    session = get_session(url)
+    upstream = rate_governor.upstream_for(url)
+    delay = 1
+
+    for attempt in range(retries):
+        if backoff:
+            backoff.wait()
+        if upstream:
+            with metrics.timed("quota_wait", QUOTA_WAIT_SECONDS, call=call):
+                rate_governor.acquire(upstream)
+        last_attempt = attempt == retries - 1
+
+        start = time.perf_counter()
+        try:
+            resp = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - start, call=call)
+            UPSTREAM_REQUESTS.inc(call=call, status="error")
+            if last_attempt:
+                raise
+            UPSTREAM_RETRIES.inc(call=call, reason="connection")
+            print(f"⚠️ {method} {url} failed ({e}), retrying in {delay}s")
+            time.sleep(delay)
+            delay *= 2
+            continue
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, call=call)
+        UPSTREAM_REQUESTS.inc(call=call, status=resp.status_code)
+        if resp.status_code == 429:
+            UPSTREAM_RATE_LIMITED.inc(call=call)
+
+        if resp.status_code in RETRY_STATUSES and not last_attempt:
+            UPSTREAM_RETRIES.inc(call=call, reason=resp.status_code)
+            wait = retry_after_seconds(resp)
+            wait = delay if wait is None else wait
+            print(f"⚠️ {resp.status_code} from {url}, retrying in {wait:.0f}s")
+            resp.close()
+            if upstream and resp.status_code == 429:
+                rate_governor.throttle(upstream, wait)
+            elif backoff:
+                backoff.hit(wait)
+            else:
+                time.sleep(wait)
+            delay *= 2
+            continue
+
+        if upstream and resp.status_code == 429:
+            rate_governor.throttle(upstream, retry_after_seconds(resp) or delay)
+        elif upstream and resp.ok:
+            rate_governor.recover(upstream)
+        return resp
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)